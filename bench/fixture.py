@@ -0,0 +1,136 @@
+# Synthetic cloud used by the benchmarks : `onevm list --xml` documents,
+# matching v4 definitions, and a PATH exposing the read-only one* stand-ins
+# of bench/fakeone, so that everything runs offline.
+
+import argparse
+import os
+import sys
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+sys.path.insert(0, os.path.join(BENCH_DIR, ".."))
+
+from opm.app import App
+
+ENV_FAKEONE_POOL = "FAKEONE_POOL"
+
+PERMISSION_NAMES = [
+    "OWNER_U", "OWNER_M", "OWNER_A",
+    "GROUP_U", "GROUP_M", "GROUP_A",
+    "OTHER_U", "OTHER_M", "OTHER_A",
+]
+
+def platform_name(index):
+    return "bench" if index == 0 else "other{0}".format(index)
+
+def host_config(index, nics, disks):
+    # what both the synthetic VM and its definition are built from
+    return {
+        "cpu_percent": 0.1 * (1 + index % 4),
+        "vcpu_count": 1 + index % 4,
+        "mem_mb": 128 * (1 + index % 8),
+        "networks": ["net{0}".format((index + k) % 16) for k in range(nics)],
+        "disks": [
+            {"image": "img{0}".format((index + k) % 32), "size_mb": 1024 * (k + 1), "dev_prefix": "vd"}
+            for k in range(disks)
+        ],
+        "group": "users",
+        "permissions": "640",
+    }
+
+def vm_xml(vm_id, name, config, state=3):
+    parts = ["<VM><ID>{0}</ID><UID>2</UID><GID>1</GID><UNAME>bench</UNAME><GNAME>{1}</GNAME><NAME>{2}</NAME>".format(vm_id, config["group"], name)]
+    parts.append("<PERMISSIONS>")
+    for position, permission_name in enumerate(PERMISSION_NAMES):
+        bit = (int(config["permissions"][position // 3]) >> (2 - position % 3)) & 1
+        parts.append("<{0}>{1}</{0}>".format(permission_name, bit))
+    parts.append("</PERMISSIONS>")
+    parts.append("<LAST_POLL>1500000000</LAST_POLL><STATE>{0}</STATE><LCM_STATE>3</LCM_STATE><PREV_STATE>3</PREV_STATE><PREV_LCM_STATE>3</PREV_LCM_STATE><RESCHED>0</RESCHED><STIME>1500000000</STIME><ETIME>0</ETIME><DEPLOY_ID>one-{1}</DEPLOY_ID>".format(state, vm_id))
+    parts.append("<MONITORING><CPU><![CDATA[1.0]]></CPU><MEMORY><![CDATA[131072]]></MEMORY><NETRX><![CDATA[123456]]></NETRX><NETTX><![CDATA[654321]]></NETTX><STATE><![CDATA[a]]></STATE></MONITORING>")
+    parts.append("<TEMPLATE><AUTOMATIC_REQUIREMENTS><![CDATA[!(PUBLIC_CLOUD = YES)]]></AUTOMATIC_REQUIREMENTS>")
+    parts.append("<CONTEXT><NETWORK><![CDATA[YES]]></NETWORK><SSH_PUBLIC_KEY><![CDATA[ssh-rsa AAAA bench]]></SSH_PUBLIC_KEY><TARGET><![CDATA[hda]]></TARGET></CONTEXT>")
+    parts.append("<CPU><![CDATA[{0}]]></CPU><MEMORY><![CDATA[{1}]]></MEMORY><VCPU><![CDATA[{2}]]></VCPU>".format(config["cpu_percent"], config["mem_mb"], config["vcpu_count"]))
+    for disk_id, disk in enumerate(config["disks"]):
+        parts.append("<DISK><CLONE><![CDATA[YES]]></CLONE><DATASTORE><![CDATA[default]]></DATASTORE><DEV_PREFIX><![CDATA[{0}]]></DEV_PREFIX><DISK_ID><![CDATA[{1}]]></DISK_ID><IMAGE><![CDATA[{2}]]></IMAGE><IMAGE_ID><![CDATA[{3}]]></IMAGE_ID><SIZE><![CDATA[{4}]]></SIZE><TARGET><![CDATA[vd{5}]]></TARGET><TYPE><![CDATA[FILE]]></TYPE></DISK>".format(
+            disk["dev_prefix"], disk_id, disk["image"], disk_id, disk["size_mb"], chr(ord("a") + disk_id % 26)))
+    for nic_id, network in enumerate(config["networks"]):
+        parts.append("<NIC><BRIDGE><![CDATA[br0]]></BRIDGE><IP><![CDATA[10.0.{0}.{1}]]></IP><MAC><![CDATA[02:00:0a:00:{0:02x}:{1:02x}]]></MAC><NETWORK><![CDATA[{2}]]></NETWORK><NETWORK_ID><![CDATA[{3}]]></NETWORK_ID><NIC_ID><![CDATA[{3}]]></NIC_ID></NIC>".format(
+            vm_id // 250 % 250, vm_id % 250, network, nic_id))
+    parts.append("<OS><ARCH><![CDATA[x86_64]]></ARCH></OS></TEMPLATE>")
+    parts.append("<USER_TEMPLATE><DESCRIPTION><![CDATA[synthetic]]></DESCRIPTION></USER_TEMPLATE>")
+    parts.append("<HISTORY_RECORDS><HISTORY><SEQ>0</SEQ><HOSTNAME>host{0}</HOSTNAME><STIME>1500000000</STIME></HISTORY></HISTORY_RECORDS></VM>".format(vm_id % 64))
+    return "".join(parts)
+
+def write_vm_pool(path, vms, platforms=10, nics=2, disks=2, drift=0.0):
+    # VM are spread over `platforms` platforms, the first one being "bench" ;
+    # `drift` is the share of bench VM whose configuration was changed
+    drift_every = int(1 / drift) if drift > 0 else 0
+    with open(path, "w") as fileobj:
+        fileobj.write("<VM_POOL>")
+        for vm_id in range(vms):
+            index = vm_id // platforms
+            config = host_config(index, nics, disks)
+            if vm_id % platforms == 0 and drift_every and index % drift_every == 0:
+                config["mem_mb"] += 64
+            name = "{0}-srv{1}".format(platform_name(vm_id % platforms), index)
+            fileobj.write(vm_xml(vm_id, name, config))
+        fileobj.write("</VM_POOL>")
+
+def definition(hosts, nics=2, disks=2, classes=0, depth=1):
+    # v4 definition of the "bench" platform matching write_vm_pool
+    jdata = {
+        "format_version": "4",
+        "platform_name": "bench",
+        "defaults": {
+            "one_template": None,
+            "arch": "x86_64",
+            "boot": None,
+            "cpu_percent": 0.1,
+            "vcpu_count": 1,
+            "mem_mb": 128,
+            "disks": [],
+            "networks": [],
+        },
+        "classes": {},
+        "hosts": {},
+    }
+    # chains of `depth` classes, each level overriding something
+    for index in range(classes):
+        class_def = {"group": "users", "permissions": "640"}
+        if index % depth != 0:
+            class_def["class"] = "class{0}".format(index - 1)
+        jdata["classes"]["class{0}".format(index)] = class_def
+    for index in range(hosts):
+        host_def = host_config(index, nics, disks)
+        if classes > 0:
+            host_def["class"] = "class{0}".format(index % classes)
+        jdata["hosts"]["srv{0}".format(index)] = host_def
+    return jdata
+
+def fake_environment(pool_path):
+    # environment for subprocesses to use the bench/fakeone stand-ins
+    env = dict(os.environ)
+    env["PATH"] = "{0}{1}{2}".format(os.path.join(BENCH_DIR, "fakeone"), os.pathsep, env.get("PATH", ""))
+    env["ONE_XMLRPC"] = "http://fakeone.invalid:2633/RPC2"
+    env[ENV_FAKEONE_POOL] = pool_path
+    return env
+
+def app(**overrides):
+    args = {
+        "log_level": "warning",
+        "backend": "cli",
+        "owner": "all",
+        "poll_interval": 5,
+        "jobs": 1,
+        "retries": 3,
+        "retry_delay": 0.5,
+        "max_in_flight": 3,
+        "limit": None,
+        "metrics_out": None,
+        "metrics_format": None,
+        "endpoint": {},
+        "output": "text",
+        "hotplug": False,
+    }
+    args.update(overrides)
+    return App(argparse.Namespace(**args))
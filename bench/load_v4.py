@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+#
+# Times App.load_v4 on synthetic definitions, against the former per-host
+# recursive class application.
+#
+#   ./bench/load_v4.py --hosts 5000 --classes 200 --depth 8
+
+import argparse
+import time
+
+import fixture
+
+from opm.vminfo import VmInfo
+
+def load_v4_recursive(jdata):
+    # the former algorithm : walk the class chain again for every host
+    def apply_class_recursive(vm, current_definition):
+        vm_class = current_definition.get('class')
+        if vm_class is not None:
+            apply_class_recursive(vm, jdata['classes'][vm_class])
+        vm.override_config(current_definition)
+    defs = {}
+    for vm_name, vm_host_def in jdata['hosts'].items():
+        vm = VmInfo()
+        vm.name = "{0}-{1}".format(jdata['platform_name'], vm_name)
+        vm.override_config(jdata['defaults'])
+        apply_class_recursive(vm, vm_host_def)
+        defs[vm.name] = vm
+    return defs
+
+def timed(func, *args, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def main():
+    parser = argparse.ArgumentParser(description="load_v4 benchmark")
+    parser.add_argument("--hosts", type=int, default=5000)
+    parser.add_argument("--classes", type=int, default=200)
+    parser.add_argument("--depth", type=int, default=8)
+    args = parser.parse_args()
+    jdata = fixture.definition(args.hosts, classes=args.classes, depth=args.depth)
+    app = fixture.app()
+    before, old = timed(load_v4_recursive, jdata)
+    after, new = timed(app.load_v4, jdata)
+    if repr(sorted(old.items())) != repr(sorted(new.items())):
+        raise Exception("Resolved definitions differ")
+    print("{0} hosts, {1} classes, depth {2}".format(args.hosts, args.classes, args.depth))
+    print("recursive : {0:.3f}s ({1:.0f} hosts/s)".format(before, args.hosts / before))
+    print("resolved  : {0:.3f}s ({1:.0f} hosts/s)".format(after, args.hosts / after))
+    print("speedup   : x{0:.1f}".format(before / after))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+#
+# Times the parse / load / diff hot paths on a synthetic cloud, offline :
+#
+#   ./bench/run.py --vms 10000 --save baseline.json
+#   ./bench/run.py --vms 10000 --baseline baseline.json --tolerance 0.25
+#
+# Each stage is timed on its own (best of --repeat runs), then run once more
+# under tracemalloc to report its peak memory, and the memory still held by
+# what it built (for instance the VmInfo kept by App.list). With --baseline, the exit code
+# is 1 when a stage got slower per item than the baseline by more than
+# --tolerance.
+
+import argparse
+import gc
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import xml.etree.ElementTree as ElementTree
+
+import fixture
+
+from opm.platform import Platform
+from opm.vmdisk import VmDisk
+from opm.vminfo import VmInfo
+
+def stages(pool_path, vms, hosts, nics, disks):
+    # name -> (setup, stage), setup's result is given to stage, which returns
+    # the number of items it handled
+    def parsed_pool():
+        return ElementTree.parse(pool_path).getroot()
+
+    def vmdisk_from_one_xml(root):
+        elems = root.findall("VM/TEMPLATE/DISK")
+        for elem in elems:
+            VmDisk.from_one_xml(elem)
+        return len(elems)
+
+    def parsed_pool_and_store():
+        return parsed_pool(), []
+
+    def vminfo_from_one_xml(data):
+        # parsed VM are kept, as a diff of the whole pool would
+        root, parsed = data
+        elems = root.findall("VM")
+        for elem in elems:
+            parsed.append(VmInfo.from_one_xml(elem))
+        return len(elems)
+
+    def app_list(app):
+        # every listed VM is looked at, whether it is kept or not
+        app.inventory = None
+        app.list(app.platforms[0])
+        return vms
+
+    def loaded_app():
+        app = fixture.app()
+        app.set_platforms([Platform("bench")])
+        return app
+
+    def app_load_v4(jdata):
+        return len(fixture.app().load_v4(jdata))
+
+    def compared():
+        app = fixture.app()
+        target = app.load_v4(fixture.definition(hosts, nics, disks))
+        app.set_platforms([Platform(app.platform_name, app.platform_is_domain, None, target)])
+        return target, app.list(app.platforms[0])
+
+    def compare_config(data):
+        target, existing = data
+        for vm_name in target.keys() & existing.keys():
+            existing[vm_name].compare_config(target[vm_name])
+        return len(target)
+
+    def app_drifted(data):
+        # digests first, detailed diff of the drifted VM only
+        target, existing = data
+        app = fixture.app()
+        app.target = target
+        app.existing = existing
+        for vm_name in app.drifted(target.keys() & existing.keys()):
+            existing[vm_name].compare_config(target[vm_name])
+        return len(target)
+
+    return [
+        ("VmDisk.from_one_xml", parsed_pool, vmdisk_from_one_xml),
+        ("VmInfo.from_one_xml", parsed_pool_and_store, vminfo_from_one_xml),
+        ("App.list", loaded_app, app_list),
+        ("App.load_v4", lambda: fixture.definition(hosts, nics, disks, classes=max(1, hosts // 50), depth=4), app_load_v4),
+        ("VmInfo.compare_config", compared, compare_config),
+        ("App.drifted", compared, app_drifted),
+    ]
+
+def measure(setup, stage, repeat):
+    best = None
+    for _ in range(repeat):
+        data = setup()
+        gc.collect()
+        start = time.perf_counter()
+        items = stage(data)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+        del data
+    # separate run for memory, tracemalloc slows everything down
+    data = setup()
+    gc.collect()
+    tracemalloc.start()
+    stage(data)
+    gc.collect()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"items": items, "seconds": best, "per_second": items / best if best > 0 else None, "peak_bytes": peak, "retained_bytes": retained}
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, result in results.items():
+        reference = baseline.get(name)
+        if reference is None or result["items"] == 0 or reference["items"] == 0:
+            continue
+        ratio = (result["seconds"] / result["items"]) / (reference["seconds"] / reference["items"])
+        if ratio > 1 + tolerance:
+            regressions.append("{0} is {1:.0%} slower per item than the baseline".format(name, ratio - 1))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="one-pf-manage benchmarks")
+    parser.add_argument("--vms", type=int, default=10000, help="VM in the synthetic cloud (default: 10000)")
+    parser.add_argument("--platforms", type=int, default=10, help="platforms they are spread over, one being benchmarked (default: 10)")
+    parser.add_argument("--nics", type=int, default=2)
+    parser.add_argument("--disks", type=int, default=2)
+    parser.add_argument("--drift", type=float, default=0.01, help="share of benchmarked VM that differ from their definition (default: 0.01)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--only", action="append", metavar="STAGE", help="only run this stage, may be repeated")
+    parser.add_argument("--save", metavar="FILE", help="write results as JSON")
+    parser.add_argument("--baseline", metavar="FILE", help="results to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        pool_path = os.path.join(directory, "pool.xml")
+        fixture.write_vm_pool(pool_path, args.vms, args.platforms, args.nics, args.disks, args.drift)
+        os.environ.update(fixture.fake_environment(pool_path))
+        hosts = (args.vms + args.platforms - 1) // args.platforms
+        print("{0} VM ({1:.1f} MB of XML), {2} of them in the benchmarked platform".format(
+            args.vms, os.path.getsize(pool_path) / 1e6, hosts))
+        results = {}
+        for name, setup, stage in stages(pool_path, args.vms, hosts, args.nics, args.disks):
+            if args.only and name not in args.only:
+                continue
+            results[name] = result = measure(setup, stage, args.repeat)
+            print("{0:<24} {1:>8} items {2:>9.3f}s {3:>12.0f} items/s {4:>9.1f} MB peak {5:>9.1f} MB retained".format(
+                name, result["items"], result["seconds"], result["per_second"] or 0, result["peak_bytes"] / 1e6, result["retained_bytes"] / 1e6))
+
+    if args.save:
+        with open(args.save, "w") as fileobj:
+            json.dump(results, fileobj, indent=4, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as fileobj:
+            regressions = compare(results, json.load(fileobj), args.tolerance)
+        for regression in regressions:
+            print("REGRESSION: {0}".format(regression))
+        if len(regressions) > 0:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
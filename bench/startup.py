@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+#
+# Times opm.py start-up for the commands that do not talk to OpenNebula, as
+# run by pre-commit hooks and CI on definition files :
+#
+#   ./bench/startup.py --repeat 20
+#
+# Each command is run --repeat times in a fresh interpreter, reporting the
+# best wall time, and once more with `-X importtime` to count the modules it
+# imports and the time spent importing them.
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+OPM = os.path.join(BENCH_DIR, "..", "opm.py")
+
+EXAMPLE = os.path.join(BENCH_DIR, "..", "docs", "example.json")
+
+COMMANDS = [
+    ("--help", ["--help"]),
+    ("parse-only", ["parse-only", EXAMPLE]),
+    ("validate", ["validate", "--no-cache", EXAMPLE]),
+]
+
+def wall_time(args, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, OPM, *args], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def import_time(args):
+    # lines are "import time: self [us] | cumulative | imported package"
+    result = subprocess.run([sys.executable, "-X", "importtime", OPM, *args], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=True)
+    modules = 0
+    total = 0
+    for line in result.stderr.decode().splitlines():
+        m = re.match(r'import time:\s+(\d+) \|', line)
+        if m:
+            modules += 1
+            total += int(m.group(1))
+    return modules, total / 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description="one-pf-manage start-up benchmark")
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+    for name, command in COMMANDS:
+        seconds = wall_time(command, args.repeat)
+        modules, imports = import_time(command)
+        print("{0:<12} {1:>7.3f}s wall {2:>5} modules {3:>7.3f}s importing".format(name, seconds, modules, imports))
+
+if __name__ == '__main__':
+    main()
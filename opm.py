@@ -1,15 +1,8 @@
 #!/usr/bin/env python3
 
 import argparse
-import json
 import logging
-import os
-import re
-import subprocess
 import sys
-import xml.etree.ElementTree as ElementTree
-
-from opm.app import App
 
 def main():
     try:
@@ -18,12 +11,111 @@ def main():
         parser.add_argument("--limit", action="append",
             help="Limit action to specified systems. May be specified multiple"
             " times to extend the limitation to several systems.")
-        parser.add_argument("action", choices=["status", "create-missing", "synchronize", "delete-unreferenced", "delete-all", "parse-only"], default="status")
+        parser.add_argument("-j", "--jobs", metavar="N", type=int, default=1,
+            help="Number of VM processed concurrently by create-missing,"
+            " synchronize, watch and apply, or of definition files checked"
+            " concurrently by validate (default: 1). VM are deleted in"
+            " batches, whatever N.")
+        parser.add_argument("--backend", choices=["cli", "xmlrpc"], default="cli",
+            help="Talk to OpenNebula through its CLI tools, or directly to the"
+            " ONE_XMLRPC endpoint (default: cli).")
+        parser.add_argument("--endpoint", metavar="PLATFORM=URL[,ONE_AUTH]", action="append", default=[],
+            help="Manage PLATFORM on the OpenNebula frontend at URL, with the"
+            " credentials of the ONE_AUTH file if given, rather than the"
+            " endpoint of its definition file or of the environment. May be"
+            " specified multiple times.")
+        parser.add_argument("--retries", metavar="N", type=int, default=3,
+            help="Send an OpenNebula command or call again up to N times when"
+            " it timed out or the VM was locked, waiting longer each time"
+            " (default: 3).")
+        parser.add_argument("--retry-delay", metavar="SECONDS", type=float, default=0.5,
+            help="Base delay before the first retry, doubled for each of the"
+            " next ones and randomized (default: 0.5).")
+        parser.add_argument("--max-in-flight", metavar="N", type=int,
+            help="Maximum number of commands or calls running at the same"
+            " time against an endpoint, lowered while it answers slowly or"
+            " fails (default: three times --jobs).")
+        parser.add_argument("--owner", metavar="SCOPE", default="all",
+            help="Only list VM in this scope on the OpenNebula side : 'all'"
+            " (every VM the user can see), 'mine', 'group' (mine and my groups"
+            " VM), 'primary-group', or a numeric user ID (default: all).")
+        parser.add_argument("--cache-ttl", metavar="SECONDS", type=int, default=60,
+            help="Reuse the VM listing of a previous run made less than"
+            " SECONDS ago for read-only actions (status), 0 disables the cache"
+            " (default: 60).")
+        parser.add_argument("--no-cache", action="store_true",
+            help="Always query OpenNebula, ignoring the cached listing.")
+        parser.add_argument("--cache-dir", metavar="DIR",
+            help="Cache location (default: $XDG_CACHE_HOME/one-pf-manage).")
+        parser.add_argument("--interval", metavar="SECONDS", type=int, default=60,
+            help="Delay between two reconciliations of the watch action"
+            " (default: 60).")
+        parser.add_argument("--release", action="store_true",
+            help="Release VM once created by create-missing, apply or watch,"
+            " as they are created on hold.")
+        parser.add_argument("--waves", action="store_true",
+            help="With --release, release VM in waves the free CPU and memory"
+            " of the hosts can run, each once the former one is deployed, and"
+            " report the waves and time remaining.")
+        parser.add_argument("--wait", metavar="STATE",
+            choices=["pending", "hold", "active", "running", "stopped", "suspended", "poweroff", "undeployed"],
+            help="Wait for VM created by create-missing, apply or watch to"
+            " reach STATE.")
+        parser.add_argument("--wait-timeout", metavar="SECONDS", type=int,
+            help="Maximum time to wait for --wait (default: 600). With"
+            " synchronize, wait that long for VM to be in a state where"
+            " they can be resized instead of failing.")
+        parser.add_argument("--poll-interval", metavar="SECONDS", type=int, default=5,
+            help="Delay between two VM state checks while waiting"
+            " (default: 5).")
+        parser.add_argument("--metrics-out", metavar="FILE",
+            help="Write timings of each phase and of each OpenNebula command"
+            " or call (exit code, output sizes) to FILE.")
+        parser.add_argument("--metrics-format", choices=["json", "prometheus"],
+            help="Format of --metrics-out (default: prometheus textfile when"
+            " FILE ends with .prom, json otherwise).")
+        parser.add_argument("--output", choices=["text", "ndjson"], default="text",
+            help="Report results as text lines, or as one JSON object per VM"
+            " and action, written as soon as the VM is done (default: text).")
+        parser.add_argument("--hotplug", action="store_true",
+            help="With synchronize, watch and apply, attach and detach NIC and"
+            " disks other than the first one, and grow disks, to match the"
+            " definitions. Data of detached disks may be lost.")
+        parser.add_argument("--dry-run", action="store_true",
+            help="With apply, only display the plan.")
+        parser.add_argument("--plan-out", metavar="FILE",
+            help="With apply, also write the plan to FILE as JSON.")
+        parser.add_argument("action", choices=["status", "create-missing", "synchronize", "delete-unreferenced", "delete-all", "parse-only", "validate", "watch", "apply"], default="status")
         parser.add_argument("jsonfile", nargs='+')
         args = parser.parse_args()
+        if args.wait is not None and args.wait_timeout is None:
+            args.wait_timeout = 600
+        if args.waves and not args.release:
+            parser.error("--waves requires --release")
+        if args.jobs < 1:
+            parser.error("--jobs must be at least 1")
+        if args.retries < 0:
+            parser.error("--retries cannot be negative")
+        if args.max_in_flight is None:
+            # a VM pipeline runs up to three commands at once
+            args.max_in_flight = 3 * args.jobs
+        elif args.max_in_flight < 1:
+            parser.error("--max-in-flight must be at least 1")
+        if not args.owner.isdigit() and args.owner not in ["all", "mine", "group", "primary-group"]:
+            parser.error("--owner must be one of all, mine, group, primary-group or a user ID")
+        endpoints = {}
+        for mapping in args.endpoint:
+            platform_name, sep, endpoint = mapping.partition("=")
+            if not sep or not platform_name or not endpoint:
+                parser.error("--endpoint expects PLATFORM=URL[,ONE_AUTH], got {0}".format(mapping))
+            url, sep, one_auth = endpoint.partition(",")
+            endpoints[platform_name] = (url, one_auth if sep else None)
+        args.endpoint = endpoints
+        # after parsing, so that --help does not load the application
+        from opm.app import App
         app = App(args)
-        app.run_all()
-        sys.exit(0)
+        failures = app.run_all()
+        sys.exit(1 if len(failures) > 0 else 0)
 
     except KeyboardInterrupt as e:
         logging.warning("Caught SIGINT (Ctrl-C), exiting.")
@@ -42,6 +134,7 @@ def main():
         # when debugging, we want the stack-trace
         if args.log_level == "debug":
             raise e
+        sys.exit(1)
 
 if __name__ == '__main__':
     main()
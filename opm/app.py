@@ -1,24 +1,54 @@
 import json
 import logging
-import re
+import os
+import threading
+import time
 
-from .opennebula import OpenNebula
+from .metrics import metrics
+from .nameindex import NameIndex
+from .plan import Plan, PlanStep
+from .platform import Platform
+from .report import Reporter
 from .vminfo import VmInfo
 
 class App:
 
+    # actions allowed to use a cached inventory
+    READ_ONLY_ACTIONS=["status"]
+
+    # actions that may instantiate templates
+    CREATE_ACTIONS=["create-missing", "watch", "apply"]
+
+    # differences that require a resizable state
+    RESIZE_KEYS=set(["cpu_percent", "vcpu_count", "mem_mb"])
+
+    # differences only applied with --hotplug
+    HOTPLUG_KEYS=set(["networks", "disks"])
+
     def __init__(self, args):
         self.args = args
         self.setup_logging()
         self.target = {}
         self.existing = {}
-        self.one = OpenNebula()
+        self.platforms = []
+        self.names = NameIndex()
+        self.inventory = None
+        self.use_cache = False
+        # one backend and state tracker per OpenNebula endpoint, created on
+        # first use
+        self.backends = {}
+        self.trackers = {}
+        self.backends_lock = threading.Lock()
+        self.reporter = Reporter(self.args.output)
 
     def setup_logging(self):
         # root logger
         numeric_level = getattr(logging, self.args.log_level.upper())
         root_logger = logging.getLogger()
         root_logger.setLevel(numeric_level)
+        if len(root_logger.handlers) > 0:
+            # already set up, by a former App of this process or its parent
+            return
         # format
         log_format = "%(message)s"
         if numeric_level == logging.DEBUG:
@@ -35,65 +65,152 @@ class App:
         formatter = logging.Formatter(log_format)
         handler.setFormatter(formatter)
         root_logger.addHandler(handler)
-        logging.debug("Command line arguments: {0}".format(self.args))
+        if numeric_level == logging.DEBUG:
+            logging.debug("Command line arguments: {0}".format(self.args))
 
-    def apply_class_recursive(self, jdata, vm, current_definition):
-        try:
-            vm_class = current_definition['class']
-        except KeyError:
-            vm_class = None
-        # depth-first aplpication
-        if vm_class is not None:
-            self.apply_class_recursive(jdata, vm, jdata['classes'][vm_class])
-        # apply provided overrides
-        vm.override_config(current_definition)
-        logging.debug("VM after class override {0}".format(vm))
+    def resolve_classes(self, jdata):
+        # flatten each class once into the overrides of its whole chain, so
+        # that a host is built with a single merge whatever its class depth
+        classes = jdata.get('classes') or {}
+        resolved = {}
+        for class_name in classes:
+            chain = []
+            current = class_name
+            while current is not None and current not in resolved:
+                if current in chain:
+                    raise Exception("Cyclic class reference: {0}".format(" -> ".join(chain + [current])))
+                if current not in classes:
+                    raise Exception("Unknown class {0} referenced by class {1}".format(current, chain[-1]))
+                chain.append(current)
+                current = classes[current].get('class')
+            # depth-first application
+            overrides = resolved[current] if current is not None else {}
+            for name in reversed(chain):
+                overrides = dict(overrides)
+                overrides.update(classes[name])
+                overrides.pop('class', None)
+                resolved[name] = overrides
+        logging.debug("Resolved classes: {0}".format(resolved))
+        return resolved
 
     def load_v4(self, jdata):
         defs = {}
         self.platform_name = jdata['platform_name'].strip()
         self.platform_is_domain = jdata.get('platform_is_domain', False)
+        self.platform_endpoint = jdata.get('endpoint')
+        self.platform_one_auth = jdata.get('one_auth')
         if len(self.platform_name) == 0:
             raise Exception("Platform name cannot be empty, because every"
                 " accessible OpenNebula VM would be considered part of the"
                 " platform !")
+        classes = self.resolve_classes(jdata)
+        defaults = jdata.get('defaults') or {}
+        debug = logging.getLogger().isEnabledFor(logging.DEBUG)
         for vm_name, vm_host_def in jdata['hosts'].items():
-            logging.debug("VM {0} definition {1}".format(vm_name, vm_host_def))
             # initialize vm data
             vm = VmInfo()
             if self.platform_is_domain:
                 vm.name = "{}.{}".format(vm_name, self.platform_name)
             else:
                 vm.name = "{0}-{1}".format(self.platform_name, vm_name)
-            # load default configuration
-            try:
-                defaults = jdata['defaults']
-            except KeyError:
-                defaults = None
-            if defaults is not None:
-                vm.override_config(defaults)
-            logging.debug("VM after defaults {0}".format(vm))
-            # apply overrides recursively by levels (hosts)
-            self.apply_class_recursive(jdata, vm, vm_host_def)
-            logging.debug("VM final configuration {0}".format(vm))
+            # defaults, then class chain, then host overrides
+            overrides = dict(defaults)
+            vm_class = vm_host_def.get('class')
+            if vm_class is not None:
+                try:
+                    overrides.update(classes[vm_class])
+                except KeyError:
+                    raise Exception("Unknown class {0} referenced by host {1}".format(vm_class, vm_name))
+            overrides.update(vm_host_def)
+            vm.override_config(overrides)
+            if debug:
+                logging.debug("VM {0} definition {1}, final configuration {2}".format(vm_name, vm_host_def, vm))
             # store final
             defs[vm.name] = vm
-        logging.debug("VM definitions: {0}".format(defs))
+        if debug:
+            logging.debug("VM definitions: {0}".format(defs))
         return defs
 
     def load(self, jsonfile):
         with open(jsonfile) as fileobj:
-            j = json.load(fileobj)
-            if int(j['format_version']) == 4:
-                return self.load_v4(j)
-            raise Exception("Unhandled format {0}".format(j['format_version']))
+            return self.load_definition(json.load(fileobj))
+
+    def load_definition(self, j):
+        if int(j['format_version']) == 4:
+            return self.load_v4(j)
+        raise Exception("Unhandled format {0}".format(j['format_version']))
+
+    def new_platform(self, jsonfile, target):
+        # the platform of the definition just loaded, --endpoint taking
+        # precedence over the file for its endpoint
+        endpoint, one_auth = self.args.endpoint.get(self.platform_name, (self.platform_endpoint, self.platform_one_auth))
+        return Platform(self.platform_name, self.platform_is_domain, jsonfile, target, endpoint, one_auth)
+
+    def backend(self, platform):
+        # backends are shared by the platforms of a same endpoint ; like the
+        # cache and thread pools, they are only imported by actions talking to
+        # OpenNebula, to keep parse-only start-up short
+        from .callguard import CallGuard
+        from .tracker import StateTracker
+        key = (platform.endpoint, platform.one_auth)
+        with self.backends_lock:
+            if key not in self.backends:
+                if self.args.backend == "xmlrpc":
+                    from .onexmlrpc import OneXmlRpc
+                    one = OneXmlRpc(platform.endpoint, platform.one_auth)
+                else:
+                    from .opennebula import OpenNebula
+                    one = OpenNebula(platform.endpoint, platform.one_auth)
+                one.guard = CallGuard(one.endpoint_name(), self.args.max_in_flight, self.args.retries, self.args.retry_delay)
+                self.backends[key] = one
+                self.trackers[one] = StateTracker(one, self.args.owner, self.args.poll_interval, self.args.jobs)
+            return self.backends[key]
+
+    def set_platforms(self, platforms):
+        # index VM names of all platforms, refusing VM claimed by several
+        names = NameIndex()
+        for platform in platforms:
+            names.add(platform)
+        collisions = names.collisions()
+        if len(collisions) > 0:
+            raise Exception("VM claimed by several definitions:\n\t{0}".format("\n\t".join(
+                "{0}: {1}".format(vm_name, ", ".join(
+                    "platform {0} ({1})".format(platform.name, platform.jsonfile) for platform in claimed))
+                for vm_name, claimed in collisions)))
+        self.platforms = platforms
+        self.names = names
+
+    def platform_of(self, vm_name):
+        platform = self.names.owner(vm_name)
+        if platform is None:
+            raise Exception("VM {0} belongs to no loaded platform".format(vm_name))
+        return platform
+
+    def backend_of(self, vm_name):
+        return self.backend(self.platform_of(vm_name))
+
+    def used_backends(self):
+        backends = []
+        for platform in self.platforms:
+            one = self.backend(platform)
+            if one not in backends:
+                backends.append(one)
+        return backends
+
+    def fan_out(self, func, backends):
+        # func(backend) for every backend at the same time, the first error
+        # being raised once all of them are done
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=max(1, len(backends))) as executor:
+            futures = [executor.submit(func, one) for one in backends]
+        return [future.result() for future in futures]
 
     def create(self, vm_name):
         logging.info("VM {0} does not exist, creating it".format(vm_name))
         vm = self.target[vm_name]
-        self.one.vm_create(vm)
+        self.backend_of(vm_name).vm_create(vm)
         logging.debug("Created VM with ID {0}".format(vm.id))
-        print("{0}: created ID {1}".format(vm.name, vm.id))
+        return self.reporter.record("create", "created", vm.name, vm)
 
     def synchronize(self, vm_name):
         logging.info("Synchronizing VM {0}".format(vm_name))
@@ -103,54 +220,422 @@ class App:
             raise Exception("Both VM do not refer to the same host")
         differences = current.compare_config(target)
         if len(differences) > 0:
-            delta = ", ".join([
-                "changing {0} from {1} to {2}".format(key, change[0], change[1])
-                for key, change in differences.items()
-                ])
-            print("{0}: ID {1}, {2}".format(vm_name, current.id, delta))
-            self.one.vm_synchronize(current, differences)
-
-    def destroy(self, vm_name):
-        logging.info("Destroying unreferenced VM {0}".format(vm_name))
-        vm = self.existing[vm_name]
-        self.one.vm_destroy(vm)
-        logging.debug("Destroyed VM with ID {0}".format(vm.id))
-        print("{0}: destroyed ID {1}".format(vm.name, vm.id))
-
-    def list(self, platform_name):
-        vms = self.one.vm_list()
-        # ignoring VM without our prefix
-        if self.platform_is_domain:
-            pattern = r'.*\.{}'.format(platform_name)
-        else:
-            pattern = r'{}-.*'.format(platform_name)
-        vms = {
-            key:value for key, value in vms.items()
-            if re.match(pattern, value.name)
-        }
+            skipped = {} if self.args.hotplug else {key: change for key, change in differences.items() if key in self.HOTPLUG_KEYS}
+            self.backend_of(vm_name).vm_synchronize(current, differences, self.args.hotplug)
+            if len(skipped) > 0:
+                applied = {key: change for key, change in differences.items() if key not in skipped}
+                return self.reporter.record("update", "partial", vm_name, current, applied, skipped=skipped)
+            return self.reporter.record("update", "synchronized", vm_name, current, differences)
+        return self.reporter.record("update", "unchanged", vm_name, current)
+
+    def drifted(self, vm_names):
+        # VM whose configuration differs from their definition, found with a
+        # set difference of digests so that only those get a detailed diff
+        target_digests = set()
+        existing_digests = set()
+        for vm_name in vm_names:
+            target = self.target[vm_name]
+            current = self.existing[vm_name]
+            mask = target.config_mask(current)
+            target_digests.add((vm_name, target.digest(mask)))
+            existing_digests.add((vm_name, current.digest(mask)))
+        drifted = set(pair[0] for pair in target_digests.difference(existing_digests))
+        logging.info("{0} VM out of {1} differ from their definition".format(len(drifted), len(vm_names)))
+        return drifted
+
+    def destroy_all(self, vm_names):
+        # VM of each endpoint terminated in batches rather than one by one,
+        # endpoints at the same time ; reported like run_jobs
+        failures = {}
+        if len(vm_names) == 0:
+            return failures
+        by_backend = {}
+        for vm_name in sorted(vm_names):
+            logging.info("Destroying VM {0}".format(vm_name))
+            by_backend.setdefault(self.backend_of(vm_name), []).append(self.existing[vm_name])
+        done, records = self.collect("destroy", "destroyed")
+        self.fan_out(lambda one: one.vm_destroy_many(by_backend[one], self.args.owner, done), list(by_backend))
+        failures = self.report(records)
+        # the shared inventory no longer reflects OpenNebula
+        self.inventory = None
+        logging.info("{0} VM processed, {1} succeeded, {2} failed".format(
+            len(records), len(records) - len(failures), len(failures)))
+        return failures
+
+    def run_jobs(self, func, vm_names, action):
+        # run each VM pipeline in a worker, func returning its record, but
+        # report in a stable order unless streaming
+        failures = {}
+        if len(vm_names) == 0:
+            return failures
+        changed = False
+        def job(vm_name):
+            start = time.monotonic()
+            try:
+                record = func(vm_name)
+                error = None
+            except Exception as e:
+                record = self.reporter.record(action, "failed", vm_name, self.existing.get(vm_name), error=e)
+                error = e
+            record["seconds"] = time.monotonic() - start
+            if self.reporter.streaming:
+                self.reporter.emit(record)
+            return record, error
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=self.args.jobs) as executor:
+            futures = [
+                (vm_name, executor.submit(job, vm_name))
+                for vm_name in sorted(vm_names)
+            ]
+            for vm_name, future in futures:
+                record, error = future.result()
+                failures.update(self.report({vm_name: (record, error)}))
+                if record["outcome"] != "unchanged":
+                    changed = True
+        if changed or len(failures) > 0:
+            # the shared inventory no longer reflects OpenNebula
+            self.inventory = None
+        logging.info("{0} VM processed, {1} succeeded, {2} failed".format(
+            len(futures), len(futures) - len(failures), len(failures)))
+        return failures
+
+    def collect(self, action, outcome):
+        # done(vm, error, seconds) callback of batched actions, and the
+        # {name: (record, error)} it fills, streamed as they come if asked
+        records = {}
+        def done(vm, error, seconds):
+            record = self.reporter.record(action, outcome if error is None else "failed", vm.name, vm, seconds=seconds, error=error)
+            records[vm.name] = (record, error)
+            if self.reporter.streaming:
+                self.reporter.emit(record)
+        return done, records
+
+    def report(self, records):
+        # records are {name: (record, None or error)}, emitted in a stable
+        # order unless already streamed
+        failures = {}
+        for vm_name in sorted(records):
+            record, error = records[vm_name]
+            if not self.reporter.streaming:
+                self.reporter.emit(record)
+            if error is not None:
+                logging.error("{0}: {1}: {2}".format(vm_name, error.__class__.__name__, error))
+                failures[vm_name] = error
+        return failures
+
+    def track(self, func, vms):
+        # func(tracker, vms) with each endpoint tracker and its VM, all
+        # endpoints being tracked at the same time
+        by_backend = {}
+        for vm in vms:
+            by_backend.setdefault(self.backend_of(vm.name), []).append(vm)
+        results = {}
+        for result in self.fan_out(lambda one: func(self.trackers[one], by_backend[one]), list(by_backend)):
+            results.update(result)
+        return results
+
+    def track_created(self, vm_names):
+        vms = [self.target[vm_name] for vm_name in sorted(vm_names)]
+        failures = {}
+        if self.args.release:
+            with metrics.phase("release"):
+                done, records = self.collect("release", "released")
+                if self.args.waves:
+                    self.track(lambda tracker, vms: tracker.release_waves(vms, self.args.wait_timeout or 600, done,
+                        self.wave_progress(tracker.one)), vms)
+                else:
+                    self.track(lambda tracker, vms: tracker.release(vms, done), vms)
+                failures.update(self.report(records))
+            vms = [vm for vm in vms if vm.name not in failures]
+        if self.args.wait is not None:
+            with metrics.phase("wait"):
+                # the outcome is the state waited for
+                done, records = self.collect("wait", self.args.wait)
+                self.track(lambda tracker, vms: tracker.wait(vms, self.args.wait, self.args.wait_timeout, done), vms)
+                failures.update(self.report(records))
+        return failures
+
+    def wave_progress(self, one):
+        # progress(wave, waves, released, remaining_seconds) of an endpoint,
+        # reported as soon as each wave starts
+        def progress(wave, waves, released, remaining_seconds):
+            logging.info("Releasing wave {0} of {1} on {2} ({3} VM)".format(wave, waves, one.endpoint_name(), released))
+            self.reporter.emit(self.reporter.wave(one.endpoint_name(), wave, waves, released, remaining_seconds))
+        return progress
+
+    def wait_resizable(self, vm_names):
+        from .tracker import StateTracker
+        blocked = [
+            self.existing[vm_name] for vm_name in sorted(vm_names)
+            if self.existing[vm_name].state not in StateTracker.RESIZABLE_STATES
+            and len(self.RESIZE_KEYS.intersection(self.existing[vm_name].compare_config(self.target[vm_name]))) > 0
+        ]
+        with metrics.phase("wait_resizable"):
+            done, records = self.collect("wait", "resizable")
+            self.track(lambda tracker, vms: tracker.wait_resizable(vms, self.args.wait_timeout, done), blocked)
+            return self.report(records)
+
+    def setup_cache(self, one):
+        # the cache is always invalidated by modifications, even when not read
+        from .cache import InventoryCache
+        one.cache = InventoryCache(self.args.cache_ttl, one.endpoint_name(), one.user_name(), self.args.cache_dir)
+
+    def set_user_info(self, one):
+        key = ("user",)
+        cached = one.cache.get(key) if self.use_cache else None
+        if cached is not None:
+            one.uid, one.gid = cached
+            return
+        one.set_user_info()
+        if self.use_cache:
+            one.cache.put(key, (one.uid, one.gid))
+
+    def verify(self, one):
+        # environment checks of an endpoint, done once for the whole batch
+        with metrics.phase("verify_environment"):
+            one.verify_environment()
+            self.setup_cache(one)
+        if not self.use_cache:
+            with metrics.phase("verify_commands"):
+                one.verify_commands()
+        with metrics.phase("set_user_info"):
+            self.set_user_info(one)
+
+    def list_backend(self, one):
+        # one listing shared by every platform of the endpoint
+        platforms = [platform for platform in self.platforms if self.backend(platform) is one]
+        owned = set(platforms)
+        key = ("inventory", self.args.owner, *sorted((platform.prefix or "", platform.suffix or "") for platform in platforms))
+        vms = one.cache.get(key) if self.use_cache else None
+        if vms is None:
+            vms = one.vm_list(
+                lambda name: self.names.owner(name) in owned,
+                self.args.owner)
+            if self.use_cache:
+                one.cache.put(key, vms)
+        return vms
+
+    def refresh_inventory(self):
+        # endpoints are listed at the same time, results indexed by platform
+        with metrics.phase("vm_list"):
+            listings = self.fan_out(self.list_backend, self.used_backends())
+        self.inventory = {platform: {} for platform in self.platforms}
+        count = 0
+        for vms in listings:
+            count += len(vms)
+            for vm_name, vm in vms.items():
+                self.inventory[self.names.owner(vm_name)][vm_name] = vm
+        logging.info("Inventory refreshed, {0} VM for {1} platforms on {2} endpoints".format(count, len(self.platforms), len(listings)))
+
+    def list(self, platform):
+        if self.inventory is None:
+            self.refresh_inventory()
+        vms = self.inventory[platform]
         logging.debug("Filtered VM {0}".format(vms))
         logging.info("Existing managed VM : {0}".format(", ".join(vms.keys()) if len(vms) > 0 else "None"))
         return vms
 
+    def write_metrics(self):
+        if self.args.metrics_out is not None:
+            metrics.write(self.args.metrics_out, self.args.metrics_format)
+
     def run_all(self):
-        # parse data file
-        for json_file in self.args.jsonfile:
-            logging.info("Processing definition file: {0}".format(json_file))
-            self.target = self.load(json_file)
-            self.run()
+        try:
+            return self.run_all_measured()
+        finally:
+            self.write_metrics()
 
-    def run(self):
-        # handle parse-only
+    def run_all_measured(self):
+        failures = {}
+        if self.args.action == "validate":
+            from .validate import Validator
+            return Validator(self.args).run()
+        # parse data files
+        platforms = []
+        for json_file in self.args.jsonfile:
+            logging.info("Loading definition file: {0}".format(json_file))
+            with metrics.phase("load"):
+                target = self.load(json_file)
+            platforms.append(self.new_platform(json_file, target))
         if self.args.action == "parse-only":
-            for key in sorted(self.target):
-                print(self.target[key].pretty_tostring())
-            return
-        # get existing vm FOR OUR PLATFORM
-        OpenNebula.verify_environment()
-        OpenNebula.verify_commands()
-        self.one.set_user_info()
-        self.existing = self.list(self.platform_name)
-        # compute sets for actions
+            for platform in platforms:
+                for key in sorted(platform.target):
+                    if self.reporter.streaming:
+                        self.reporter.emit(self.reporter.record("parse", "defined", key))
+                    else:
+                        print(platform.target[key].pretty_tostring())
+            return failures
+        self.set_platforms(platforms)
+        # environment checks of every endpoint, at the same time
+        self.use_cache = not self.args.no_cache and self.args.cache_ttl > 0 and self.args.action in self.READ_ONLY_ACTIONS
+        self.fan_out(self.verify, self.used_backends())
+        if self.args.action in self.CREATE_ACTIONS:
+            with metrics.phase("validate_templates"):
+                self.validate_templates(self.platforms)
+        if self.args.action == "watch":
+            return self.watch()
+        if self.args.action == "apply":
+            return self.apply()
+        # every platform is handled at once, whatever its endpoint
+        missing, present, unreferenced = self.merge_platforms()
+        with metrics.phase(self.args.action):
+            failures = self.run_action(missing, present, unreferenced)
+        if len(failures) > 0:
+            logging.error("Failed VM : {0}".format(", ".join(sorted(failures.keys()))))
+        return failures
+
+    def merge_platforms(self):
+        # sets of every platform, against the merged targets and listings
+        missing, present, unreferenced = set(), set(), set()
+        targets = {}
+        existing = {}
+        for platform in self.platforms:
+            logging.info("Processing definition file: {0}".format(platform.jsonfile))
+            self.target = platform.target
+            self.existing = self.list(platform)
+            platform_sets = self.compute_sets()
+            missing.update(platform_sets[0])
+            present.update(platform_sets[1])
+            unreferenced.update(platform_sets[2])
+            targets.update(self.target)
+            existing.update(self.existing)
+        self.target = targets
+        self.existing = existing
+        return missing, present, unreferenced
+
+    def build_plan(self):
+        # every pending change of every platform, from a single listing
+        plan = Plan()
+        self.refresh_inventory()
+        # steps are run by name against the whole snapshot
+        missing, present, unreferenced = self.merge_platforms()
+        for vm_name in missing:
+            plan.add(PlanStep("create", vm_name, self.platform_of(vm_name).name, target=self.target[vm_name]))
+        for vm_name in self.drifted(present):
+            differences = self.existing[vm_name].compare_config(self.target[vm_name])
+            if len(differences) > 0:
+                plan.add(PlanStep("update", vm_name, self.platform_of(vm_name).name, self.existing[vm_name].id, differences))
+        for vm_name in unreferenced:
+            plan.add(PlanStep("destroy", vm_name, self.platform_of(vm_name).name, self.existing[vm_name].id))
+        return plan
+
+    def apply(self):
+        with metrics.phase("plan"):
+            plan = self.build_plan()
+        if self.reporter.streaming:
+            for step in sorted(plan.steps, key=lambda step: (step.vm_name, Plan.ACTIONS.index(step.action))):
+                self.reporter.emit(self.reporter.record(step.action, "planned", step.vm_name, self.existing.get(step.vm_name), step.differences))
+        else:
+            print(plan.tostring())
+        if self.args.plan_out is not None:
+            plan.save(self.args.plan_out)
+        if self.args.dry_run:
+            return {}
+        failures = {}
+        for action, func in [("destroy", self.destroy_all), ("create", self.create), ("update", self.synchronize)]:
+            vm_names = set(step.vm_name for step in plan.steps_for(action))
+            with metrics.phase("apply-{0}".format(action)):
+                if action == "destroy":
+                    # batched, rather than one pipeline per VM
+                    failures.update(func(vm_names))
+                else:
+                    failures.update(self.run_jobs(func, vm_names, action))
+                if action == "create":
+                    failures.update(self.track_created(vm_names.difference(failures)))
+        if len(failures) > 0:
+            logging.error("Failed VM : {0}".format(", ".join(sorted(failures.keys()))))
+        return failures
+
+    def reload(self, index):
+        # reload a definition file whose content changed on disk
+        platform = self.platforms[index]
+        logging.info("Reloading definition file: {0}".format(platform.jsonfile))
+        target = self.load(platform.jsonfile)
+        platform = self.new_platform(platform.jsonfile, target)
+        if self.backend(platform) not in self.used_backends():
+            self.verify(self.backend(platform))
+        self.validate_templates([platform])
+        platforms = list(self.platforms)
+        platforms[index] = platform
+        self.set_platforms(platforms)
+        return platform
+
+    def validate_templates(self, platforms):
+        # check user inputs of every template based VM before creating any
+        problems = []
+        for platform in platforms:
+            for vm_name, vm in sorted(platform.target.items()):
+                if vm.one_template is None:
+                    if vm.user_inputs:
+                        problems.append("{0}: user_inputs given without one_template".format(vm_name))
+                    continue
+                try:
+                    template = self.backend(platform).template_info(vm.one_template)
+                except Exception as e:
+                    problems.append("{0}: {1}".format(vm_name, e))
+                    continue
+                problems.extend("{0}: {1}".format(vm_name, problem) for problem in template.check_user_inputs(vm.user_inputs))
+                problems.extend("{0}: {1}".format(vm_name, problem) for problem in self.backend(platform).user_input_problems(template, vm.user_inputs))
+        if len(problems) > 0:
+            raise Exception("Invalid template based VM definitions:\n\t{0}".format("\n\t".join(problems)))
+
+    def watch(self):
+        # keep definitions and last seen VM in memory, and only look again at
+        # VM that changed since the previous tick, or whose file changed
+        mtimes = [os.stat(platform.jsonfile).st_mtime for platform in self.platforms]
+        signatures = {}
+        # only totals are kept, the metrics file being rewritten every tick
+        metrics.keep_events = False
+        while True:
+            start = time.monotonic()
+            try:
+                with metrics.phase("watch"):
+                    self.watch_tick(mtimes, signatures)
+            except Exception as e:
+                # an endpoint being down is no reason to stop watching
+                logging.error("Watch check failed, next one in {0}s: {1}".format(self.args.interval, e))
+            self.write_metrics()
+            time.sleep(max(0, self.args.interval - (time.monotonic() - start)))
+
+    def watch_tick(self, mtimes, signatures):
+        reloaded = set()
+        for index, platform in enumerate(self.platforms):
+            try:
+                mtime = os.stat(platform.jsonfile).st_mtime
+                if mtime != mtimes[index]:
+                    mtimes[index] = mtime
+                    reloaded.add(self.reload(index).name)
+            except Exception as e:
+                # keep the previous definitions until the file is fixed
+                logging.error("Could not reload {0}: {1}".format(platform.jsonfile, e))
+        self.inventory = None
+        seen = set()
+        for platform in self.platforms:
+            self.target = platform.target
+            self.existing = self.list(platform)
+            missing, present, unreferenced = self.compute_sets()
+            changed = set(
+                vm_name for vm_name in present
+                if platform.name in reloaded
+                or signatures.get(vm_name) != self.existing[vm_name].signature()
+            )
+            logging.info("Watch: {0} missing, {1} changed out of {2} present, {3} unreferenced".format(
+                len(missing), len(changed), len(present), len(unreferenced)))
+            seen.update(self.existing.keys())
+            for vm_name in present:
+                signatures[vm_name] = self.existing[vm_name].signature()
+            failures = self.run_jobs(self.create, missing, "create")
+            self.track_created(missing.difference(failures))
+            for vm_name in self.run_jobs(self.synchronize, self.drifted(changed), "update"):
+                # retry on next tick
+                del signatures[vm_name]
+            for vm_name in sorted(unreferenced):
+                logging.warning("{0}: unreferenced ID {1}, not deleted by watch".format(vm_name, self.existing[vm_name].id))
+        # forget VM that are gone
+        for vm_name in set(signatures).difference(seen):
+            del signatures[vm_name]
+
+    def compute_sets(self):
         current = set(self.existing.keys())
         target = set(self.target.keys())
 
@@ -161,29 +646,34 @@ class App:
         missing = target.difference(current)
         present = target.intersection(current)
         unreferenced = current.difference(target)
+        return missing, present, unreferenced
 
+    def run_action(self, missing, present, unreferenced):
+        failures = {}
         if self.args.action == "status":
             for vm_name in sorted(missing):
-                print("{0}: missing".format(self.target[vm_name].name))
+                self.reporter.emit(self.reporter.record("status", "missing", vm_name))
             for vm_name in sorted(present):
-                print("{0}: present ID {1}".format(self.existing[vm_name].name, self.existing[vm_name].id))
+                self.reporter.emit(self.reporter.record("status", "present", vm_name, self.existing[vm_name]))
             for vm_name in sorted(unreferenced):
-                print("{0}: unreferenced ID {1}".format(self.existing[vm_name].name, self.existing[vm_name].id))
+                self.reporter.emit(self.reporter.record("status", "unreferenced", vm_name, self.existing[vm_name]))
         elif self.args.action == "create-missing":
             # create what must be created
-            for vm_name in sorted(missing):
-                self.create(vm_name)
+            failures = self.run_jobs(self.create, missing, "create")
+            failures.update(self.track_created(missing.difference(failures)))
         elif self.args.action == "synchronize":
-            # synchronize what could differ
-            for vm_name in sorted(present):
-                self.synchronize(vm_name)
+            drifted = self.drifted(present)
+            # resize needs some states, transient ones can be waited for
+            if self.args.wait_timeout is not None:
+                failures = self.wait_resizable(drifted)
+            # synchronize what differs
+            failures.update(self.run_jobs(self.synchronize, drifted.difference(failures), "update"))
         elif self.args.action == "delete-unreferenced":
             # delete what should not be there
-            for vm_name in sorted(unreferenced):
-                self.destroy(vm_name)
+            failures = self.destroy_all(unreferenced)
         elif self.args.action == "delete-all":
             # delete everything that exists related to our platform
-            for vm_name in sorted(present):
-                self.destroy(vm_name)
+            failures = self.destroy_all(present)
+        return failures
 
 
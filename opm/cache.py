@@ -0,0 +1,70 @@
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+import time
+
+class InventoryCache:
+
+    ENV_XDG_CACHE_HOME="XDG_CACHE_HOME"
+
+    @classmethod
+    def default_directory(cls):
+        base = os.environ.get(cls.ENV_XDG_CACHE_HOME, os.path.expanduser("~/.cache"))
+        return os.path.join(base, "one-pf-manage")
+
+    @staticmethod
+    def digest(*parts):
+        return hashlib.sha256("\0".join(str(part) for part in parts).encode()).hexdigest()
+
+    def __init__(self, ttl, endpoint, user, directory=None):
+        self.ttl = ttl
+        if directory is None:
+            directory = self.default_directory()
+        # one sub-directory per endpoint and user, invalidated as a whole
+        self.directory = os.path.join(directory, self.digest(endpoint, user))
+        logging.debug("Inventory cache for {0} as {1} in {2}".format(endpoint, user, self.directory))
+
+    def path(self, key):
+        return os.path.join(self.directory, "{0}.pickle".format(self.digest(*key)))
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            age = time.time() - os.stat(path).st_mtime
+            if age > self.ttl:
+                logging.debug("Cache entry {0} expired ({1:.0f}s old)".format(key, age))
+                return None
+            with open(path, "rb") as fileobj:
+                value = pickle.load(fileobj)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logging.warning("Ignoring unreadable cache entry {0} (reason : {1})".format(path, e))
+            return None
+        logging.info("Using cached {0} ({1:.0f}s old)".format(key[0], age))
+        return value
+
+    def put(self, key, value):
+        try:
+            os.makedirs(self.directory, mode=0o700, exist_ok=True)
+            # write then rename, so that readers never see a partial entry
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "wb") as fileobj:
+                pickle.dump(value, fileobj, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.path(key))
+        except Exception as e:
+            logging.warning("Could not write cache entry {0} (reason : {1})".format(key, e))
+
+    def invalidate(self):
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return
+        logging.debug("Invalidating inventory cache {0}".format(self.directory))
+        for name in names:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
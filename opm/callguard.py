@@ -0,0 +1,176 @@
+import logging
+import random
+import re
+import threading
+import time
+
+from .metrics import metrics
+
+class InFlightLimiter:
+
+    # additive increase, multiplicative decrease of the number of requests
+    # sent at the same time to an endpoint, like TCP congestion control
+
+    # a call this many times slower than the fastest recent one of its kind
+    # is a sign of an overloaded endpoint
+    LATENCY_TOLERANCE=4.0
+
+    # how fast the reference latency follows calls slower than it
+    BASELINE_DRIFT=0.1
+
+    def __init__(self, maximum):
+        self.maximum = maximum
+        self.limit = float(maximum)
+        self.in_flight = 0
+        self.baselines = {}
+        self.decreased = 0.0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+
+    def release(self, key, seconds, overloaded):
+        with self.condition:
+            self.in_flight -= 1
+            baseline = self.baselines.get(key, seconds)
+            self.baselines[key] = min(seconds, baseline + (seconds - baseline) * self.BASELINE_DRIFT)
+            now = time.monotonic()
+            if overloaded or seconds > self.LATENCY_TOLERANCE * baseline:
+                # calls in flight together fail together, halve once per round trip
+                if now - self.decreased > seconds:
+                    self.limit = max(1.0, self.limit / 2)
+                    self.decreased = now
+                    logging.debug("In-flight limit lowered to {0}".format(int(self.limit)))
+            elif self.limit < self.maximum:
+                # about one more request per limit calls succeeded
+                self.limit = min(float(self.maximum), self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+class CircuitBreaker:
+
+    # consecutive endpoint failures before calls are refused
+    THRESHOLD=5
+
+    # seconds calls are refused before a single call probes the endpoint
+    COOLDOWN=30
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.failures = 0
+        self.opened = None
+        self.probing = False
+        self.lock = threading.Lock()
+
+    def before(self, description):
+        with self.lock:
+            if self.opened is None:
+                return
+            remaining = self.opened + self.COOLDOWN - time.monotonic()
+            if remaining > 0 or self.probing:
+                raise Exception("OpenNebula endpoint {0} is unavailable, not running {1} (retry in {2:.0f}s)".format(
+                    self.endpoint, description, max(0, remaining)))
+            self.probing = True
+
+    def succeeded(self):
+        with self.lock:
+            if self.opened is not None:
+                logging.info("OpenNebula endpoint {0} is available again".format(self.endpoint))
+            self.failures = 0
+            self.opened = None
+            self.probing = False
+
+    def failed(self, unavailable):
+        # answered errors show the endpoint is up, they do not count ; True
+        # once calls are suspended
+        with self.lock:
+            if not unavailable:
+                self.failures = 0
+                self.opened = None
+                self.probing = False
+                return False
+            self.failures += 1
+            if self.probing or self.failures >= self.THRESHOLD:
+                if not self.probing:
+                    logging.error("OpenNebula endpoint {0} failed {1} times in a row, calls are suspended for {2}s".format(
+                        self.endpoint, self.failures, self.COOLDOWN))
+                self.opened = time.monotonic()
+                self.probing = False
+            return self.opened is not None
+
+class CallGuard:
+
+    # OpenNebula answered that another operation holds the resource : the
+    # request was not carried out, it can always be sent again
+    LOCKED_ERRORS=re.compile(r'error code : 32768|[Ll]ocked')
+
+    # the endpoint could not be reached : the request was not carried out
+    UNREACHABLE_ERRORS=re.compile(r'Connection refused|Name or service not known|Temporary failure in name resolution')
+
+    # the outcome is unknown, only requests that can be repeated are sent again
+    TRANSIENT_ERRORS=re.compile(r'timed out|[Tt]imeout|execution expired|Connection reset|Broken pipe'
+        r'|RemoteDisconnected|Service Unavailable|Bad Gateway|[Bb]usy|try again')
+
+    def __init__(self, endpoint, max_in_flight=1, retries=3, retry_delay=0.5, max_delay=30):
+        self.endpoint = endpoint
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.max_delay = max_delay
+        self.limiter = InFlightLimiter(max_in_flight)
+        self.breaker = CircuitBreaker(endpoint)
+        self.local = threading.local()
+
+    @classmethod
+    def classify(cls, error):
+        # "locked", "unreachable", "transient" or "fatal"
+        message = str(error)
+        if cls.LOCKED_ERRORS.search(message):
+            return "locked"
+        if cls.UNREACHABLE_ERRORS.search(message):
+            return "unreachable"
+        if cls.TRANSIENT_ERRORS.search(message):
+            return "transient"
+        return "fatal"
+
+    def delay(self, attempt):
+        # exponential backoff with full jitter, so that workers failing
+        # together do not retry together
+        return random.uniform(0, min(self.max_delay, self.retry_delay * 2 ** attempt))
+
+    def run(self, description, func, idempotent=True, retry=True):
+        # func(), retried on errors that may not happen again, unless the
+        # caller has its own way to recover
+        if getattr(self.local, "active", False):
+            # nested in a guarded call, which already holds a slot
+            return func()
+        attempt = 0
+        while True:
+            self.breaker.before(description)
+            self.limiter.acquire()
+            self.local.active = True
+            start = time.monotonic()
+            try:
+                result = func()
+            except Exception as e:
+                self.local.active = False
+                kind = self.classify(e)
+                # only a struggling endpoint slows down and suspends calls
+                unavailable = kind in ("unreachable", "transient")
+                self.limiter.release(description, time.monotonic() - start, unavailable)
+                suspended = self.breaker.failed(unavailable)
+                retryable = kind in ("locked", "unreachable") or (kind == "transient" and idempotent)
+                if not retry or not retryable or suspended or attempt >= self.retries:
+                    raise
+                delay = self.delay(attempt)
+                attempt += 1
+                metrics.record_retry(description, self.endpoint, kind)
+                logging.warning("{0} failed on {1} ({2} error), retrying in {3:.1f}s ({4}/{5})".format(
+                    description, self.endpoint, kind, delay, attempt, self.retries))
+                time.sleep(delay)
+                continue
+            self.local.active = False
+            self.limiter.release(description, time.monotonic() - start, False)
+            self.breaker.succeeded()
+            return result
@@ -0,0 +1,119 @@
+import logging
+
+class HostCapacity:
+
+    # see https://docs.opennebula.org/5.4/operation/references/host_states.html,
+    # hosts the scheduler deploys VM to
+    SCHEDULED_STATES=[1, 2]
+
+    @staticmethod
+    def from_one_xml(host_elem):
+        # <HOST>
+        #   <ID>0</ID>
+        #   <NAME>node1</NAME>
+        #   <STATE>2</STATE>
+        #   <CLUSTER>default</CLUSTER>
+        #   <HOST_SHARE>
+        #     <MAX_MEM>16777216</MAX_MEM> *KB*
+        #     <MAX_CPU>800</MAX_CPU> *percent of a core*
+        #     <MEM_USAGE>1048576</MEM_USAGE> *allocated to VM*
+        #     <CPU_USAGE>100</CPU_USAGE>
+        #   </HOST_SHARE>
+        # </HOST>
+        def number(path):
+            value = host_elem.findtext(path)
+            return int(float(value)) if value is not None and value.strip() != "" else 0
+        max_cpu = number("HOST_SHARE/MAX_CPU")
+        max_mem_mb = number("HOST_SHARE/MAX_MEM") // 1024
+        return HostCapacity(
+            number("ID"),
+            host_elem.findtext("NAME"),
+            host_elem.findtext("CLUSTER"),
+            number("STATE"),
+            max_cpu,
+            max_mem_mb,
+            max_cpu - number("HOST_SHARE/CPU_USAGE"),
+            max_mem_mb - number("HOST_SHARE/MEM_USAGE") // 1024)
+
+    @staticmethod
+    def from_pool_xml(root):
+        # hosts VM can be deployed to, out of a <HOST_POOL>
+        hosts = [HostCapacity.from_one_xml(host_elem) for host_elem in root.findall("HOST")]
+        return [host for host in hosts if host.state in HostCapacity.SCHEDULED_STATES]
+
+    def __init__(self, host_id=None, name=None, cluster=None, state=None, max_cpu=0, max_mem_mb=0, free_cpu=0, free_mem_mb=0):
+        # CPU in percent of a core, like OpenNebula hosts
+        self.id = host_id
+        self.name = name
+        self.cluster = cluster
+        self.state = state
+        self.max_cpu = max_cpu
+        self.max_mem_mb = max_mem_mb
+        self.free_cpu = free_cpu
+        self.free_mem_mb = free_mem_mb
+
+    def __repr__(self):
+        return "HostCapacity(id={0}, name={1}, cluster={2}, free_cpu={3}/{4}, free_mem_mb={5}/{6})".format(
+            self.id, self.name, self.cluster, self.free_cpu, self.max_cpu, self.free_mem_mb, self.max_mem_mb)
+
+class WavePlan:
+
+    # VM to release together, largest first, each placed on the host with
+    # room left that was given the fewest VM so far. The room VM take is
+    # never given back, as VM of former waves keep running, and a host is
+    # given at most one VM per wave like the scheduler dispatches them by
+    # default (MAX_HOST in sched.conf), the k-th VM of every host making
+    # wave k.
+
+    @staticmethod
+    def demand(vm_info):
+        # (CPU in percent of a core, memory in MB) the scheduler allocates ;
+        # CPU defaults to the number of VCPU like in OpenNebula templates
+        cpu = vm_info.cpu if vm_info.cpu is not None else (vm_info.vcpu or 1)
+        return int(round(float(cpu) * 100)), int(vm_info.mem_mb or 0)
+
+    def __init__(self, hosts):
+        self.hosts = hosts
+        self.waves = []
+        # VM the hosts have no room left for, larger than any host included
+        self.unplaced = []
+
+    def __repr__(self):
+        return "WavePlan(waves={0}, unplaced={1})".format([len(wave) for wave in self.waves], len(self.unplaced))
+
+    def fits(self, demand, room):
+        # room(host) is the (cpu, mem_mb) a VM may take on it
+        cpu, mem_mb = demand
+        return any(cpu <= host_cpu and mem_mb <= host_mem_mb for host_cpu, host_mem_mb in map(room, self.hosts))
+
+    def oversized(self, demand):
+        # more than any host has, even without any VM
+        return not self.fits(demand, lambda host: (host.max_cpu, host.max_mem_mb))
+
+    def pack(self, vms, demands):
+        # waves of VM out of vms, demands being {vm name: (cpu, mem_mb)}
+        total_cpu = max(1, sum(host.free_cpu for host in self.hosts))
+        total_mem_mb = max(1, sum(host.free_mem_mb for host in self.hosts))
+        def size(vm):
+            cpu, mem_mb = demands[vm.name]
+            return max(cpu / total_cpu, mem_mb / total_mem_mb)
+        self.waves = []
+        self.unplaced = []
+        # [cpu, mem_mb, VM placed] left on each host
+        free = [[host.free_cpu, host.free_mem_mb, 0] for host in self.hosts]
+        for vm in sorted(vms, key=lambda vm: (-size(vm), vm.name)):
+            cpu, mem_mb = demands[vm.name]
+            rooms = [room for room in free if cpu <= room[0] and mem_mb <= room[1]]
+            if len(rooms) == 0:
+                self.unplaced.append(vm)
+                continue
+            room = min(rooms, key=lambda room: room[2])
+            room[0] -= cpu
+            room[1] -= mem_mb
+            if room[2] == len(self.waves):
+                self.waves.append([])
+            self.waves[room[2]].append(vm)
+            room[2] += 1
+        self.waves = [sorted(wave, key=lambda vm: vm.name) for wave in self.waves]
+        logging.debug("Planned {0}".format(self))
+        return self
@@ -0,0 +1,152 @@
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+
+class CountingReader:
+
+    # file-like wrapper counting the bytes read through it
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.count = 0
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.count += len(data)
+        return data
+
+class Metrics:
+
+    PROMETHEUS_PREFIX="opm"
+
+    @staticmethod
+    def label(value):
+        return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start = time.time()
+        # totals per phase and per (command, endpoint), and the events they
+        # come from unless keep_events is off, as for long running processes
+        self.keep_events = True
+        self.phases = []
+        self.commands = []
+        self.retries = []
+        self.phase_totals = {}
+        self.command_totals = {}
+
+    def command_total(self, command, endpoint):
+        return self.command_totals.setdefault((command, endpoint),
+            {"count": 0, "errors": 0, "retries": 0, "seconds": 0.0, "stdout_bytes": 0, "stderr_bytes": 0})
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            seconds = time.monotonic() - start
+            logging.debug("Phase {0} took {1:.3f}s".format(name, seconds))
+            with self.lock:
+                phase = self.phase_totals.setdefault(name, {"count": 0, "seconds": 0.0})
+                phase["count"] += 1
+                phase["seconds"] += seconds
+                if self.keep_events:
+                    self.phases.append({"phase": name, "seconds": seconds})
+
+    def record_command(self, command, seconds, returncode, stdout_bytes=None, stderr_bytes=None, endpoint=None):
+        # command is the full command line, totals use its first two words
+        with self.lock:
+            total = self.command_total(" ".join(command[:2]), endpoint)
+            total["count"] += 1
+            if returncode != 0:
+                total["errors"] += 1
+            total["seconds"] += seconds
+            total["stdout_bytes"] += stdout_bytes or 0
+            total["stderr_bytes"] += stderr_bytes or 0
+            if self.keep_events:
+                self.commands.append({
+                    "command": list(command),
+                    "endpoint": endpoint,
+                    "seconds": seconds,
+                    "returncode": returncode,
+                    "stdout_bytes": stdout_bytes,
+                    "stderr_bytes": stderr_bytes,
+                })
+
+    def record_retry(self, command, endpoint, kind):
+        # command is reported as is, kind is "locked", "unreachable" or "transient"
+        with self.lock:
+            self.command_total(command, endpoint)["retries"] += 1
+            if self.keep_events:
+                self.retries.append({"command": command, "endpoint": endpoint, "kind": kind})
+
+    def summary(self):
+        return (
+            {name: dict(values) for name, values in self.phase_totals.items()},
+            {key: dict(values) for key, values in self.command_totals.items()},
+        )
+
+    def to_json(self):
+        with self.lock:
+            phases, commands = self.summary()
+            report = {
+                "start": self.start,
+                "seconds": time.time() - self.start,
+                "phases": phases,
+                "commands": [
+                    dict(command=name, endpoint=endpoint, **values)
+                    for (name, endpoint), values in sorted(commands.items(), key=lambda item: (item[0][0], str(item[0][1])))
+                ],
+            }
+            if self.keep_events:
+                report["events"] = {"phases": self.phases, "commands": self.commands, "retries": self.retries}
+            return json.dumps(report, indent=4)
+
+    def to_prometheus(self):
+        with self.lock:
+            phases, commands = self.summary()
+            prefix = self.PROMETHEUS_PREFIX
+            lines = [
+                "# HELP {0}_run_seconds Wall time of the whole run.".format(prefix),
+                "# TYPE {0}_run_seconds gauge".format(prefix),
+                "{0}_run_seconds {1:.6f}".format(prefix, time.time() - self.start),
+                "# HELP {0}_phase_seconds_total Wall time spent in each phase of the run.".format(prefix),
+                "# TYPE {0}_phase_seconds_total counter".format(prefix),
+            ]
+            for name in sorted(phases):
+                lines.append('{0}_phase_seconds_total{{phase="{1}"}} {2:.6f}'.format(prefix, self.label(name), phases[name]["seconds"]))
+            # totals only ever grow, including across the ticks of watch
+            series = [
+                ("command_calls_total", "count", "OpenNebula commands or calls made."),
+                ("command_errors_total", "errors", "OpenNebula commands or calls that failed."),
+                ("command_retries_total", "retries", "OpenNebula commands or calls sent again after a failure."),
+                ("command_seconds_total", "seconds", "Wall time spent in OpenNebula commands or calls."),
+                ("command_stdout_bytes_total", "stdout_bytes", "Bytes read from OpenNebula commands standard output."),
+                ("command_stderr_bytes_total", "stderr_bytes", "Bytes read from OpenNebula commands standard error."),
+            ]
+            for metric, key, description in series:
+                lines.append("# HELP {0}_{1} {2}".format(prefix, metric, description))
+                lines.append("# TYPE {0}_{1} counter".format(prefix, metric))
+                for (name, endpoint), values in sorted(commands.items(), key=lambda item: (item[0][0], str(item[0][1]))):
+                    lines.append('{0}_{1}{{command="{2}",endpoint="{3}"}} {4}'.format(
+                        prefix, metric, self.label(name), self.label(endpoint or ""), values[key]))
+            return "\n".join(lines) + "\n"
+
+    def write(self, path, output_format=None):
+        if output_format is None:
+            output_format = "prometheus" if path.endswith(".prom") else "json"
+        content = self.to_prometheus() if output_format == "prometheus" else self.to_json()
+        # write then rename, as textfile collectors may read at any time
+        directory = os.path.dirname(os.path.abspath(path))
+        import tempfile
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as fileobj:
+            fileobj.write(content)
+        os.replace(tmp_path, path)
+        logging.info("Metrics written to {0}".format(path))
+
+# process-wide registry, like the logging module's root logger
+metrics = Metrics()
@@ -0,0 +1,58 @@
+class NameIndex:
+
+    # VM name ownership across all loaded platforms : a VM belongs to the
+    # platform with the longest prefix (or suffix, for domains) it matches,
+    # so that platform "a" does not claim the VM of platform "a-b". Lookups
+    # are hashed, one per "-" or "." in the VM name.
+
+    def __init__(self):
+        self.prefixes = {}
+        self.suffixes = {}
+        # defined VM name: platforms defining it
+        self.targets = {}
+
+    def add(self, platform, vm_names=None):
+        if platform.is_domain:
+            self.suffixes.setdefault(platform.suffix, []).append(platform)
+        else:
+            self.prefixes.setdefault(platform.prefix, []).append(platform)
+        for vm_name in (vm_names if vm_names is not None else platform.target):
+            self.targets.setdefault(vm_name, []).append(platform)
+
+    def owners(self, vm_name):
+        # platforms of the longest matching prefix or suffix, usually one
+        prefix = None
+        position = vm_name.find("-")
+        while position >= 0:
+            if vm_name[:position + 1] in self.prefixes:
+                prefix = vm_name[:position + 1]
+            position = vm_name.find("-", position + 1)
+        suffix = None
+        position = vm_name.find(".")
+        while position >= 0 and suffix is None:
+            if vm_name[position:] in self.suffixes:
+                suffix = vm_name[position:]
+            position = vm_name.find(".", position + 1)
+        if prefix is None and suffix is None:
+            return []
+        if suffix is None or (prefix is not None and len(prefix) >= len(suffix)):
+            return self.prefixes[prefix]
+        return self.suffixes[suffix]
+
+    def owner(self, vm_name):
+        # None when no platform, or several, claim the VM
+        owners = self.owners(vm_name)
+        return owners[0] if len(owners) == 1 else None
+
+    def collisions(self):
+        # [(vm_name, platforms)] for defined VM claimed by several platforms,
+        # either by definition or by name
+        collisions = []
+        for vm_name, platforms in sorted(self.targets.items()):
+            claimed = list(platforms)
+            for platform in self.owners(vm_name):
+                if not any(platform is other for other in claimed):
+                    claimed.append(platform)
+            if len(claimed) > 1:
+                collisions.append((vm_name, claimed))
+        return collisions
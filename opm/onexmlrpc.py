@@ -0,0 +1,265 @@
+import contextlib
+import io
+import logging
+import os
+import threading
+import time
+import xml.etree.ElementTree as ElementTree
+import xmlrpc.client
+
+from .metrics import metrics
+from .opennebula import OpenNebula
+from .vminfo import VmInfo
+
+class OneXmlRpc(OpenNebula):
+
+    PERMISSION_BITS=[4, 2, 1]
+
+    # listing scopes, mapped to the pool filter flag
+    LIST_OWNERS={"all": -2, "mine": -3, "group": -1, "primary-group": -4}
+
+    # any state except DONE
+    LIST_STATE=-1
+
+    VM_POOL_COMMAND="one.vmpool.info"
+
+    def verify_commands(self):
+        logging.debug("XML-RPC backend selected, OpenNebula CLI tools are not required")
+
+    @classmethod
+    def vm_template(cls, vm_info, with_name=True):
+        lines = []
+        if with_name:
+            lines.append("NAME={0}".format(cls.quote(vm_info.name)))
+        lines.append("CPU={0}".format(cls.quote(vm_info.cpu)))
+        lines.append("VCPU={0}".format(cls.quote(vm_info.vcpu)))
+        lines.append("MEMORY={0}".format(cls.quote(vm_info.mem_mb)))
+        os_attrs = []
+        if vm_info.arch is not None:
+            os_attrs.append("ARCH={0}".format(cls.quote(vm_info.arch)))
+        if vm_info.boot is not None:
+            os_attrs.append("BOOT={0}".format(cls.quote(vm_info.boot)))
+        if len(os_attrs) > 0:
+            lines.append("OS=[{0}]".format(", ".join(os_attrs)))
+        for network in vm_info.networks:
+            lines.append(cls.nic_template(network))
+        for disk in vm_info.disks or []:
+            lines.append(cls.disk_template(disk))
+        return "\n".join(lines)
+
+    def proxy(self):
+        # xmlrpc.client keeps its HTTP/1.1 connection open between requests,
+        # but a ServerProxy must not be shared between threads
+        proxy = getattr(self.local, "proxy", None)
+        if proxy is None:
+            if self.endpoint is None:
+                self.verify_environment()
+                self.endpoint = os.environ.get(self.ENV_ONEXMLRPC)
+            logging.debug("Opening XML-RPC connection to {0}".format(self.endpoint))
+            proxy = xmlrpc.client.ServerProxy(self.endpoint, allow_none=False)
+            self.local.proxy = proxy
+        return proxy
+
+    def call(self, method, *args, retry=True):
+        return self.guard.run(method, lambda: self.call_once(method, *args),
+            method not in self.UNREPEATABLE_COMMANDS, retry)
+
+    def call_once(self, method, *args):
+        if self.session is None:
+            self.session = self.read_session()
+        logging.debug("XML-RPC call: {0}{1}".format(method, args))
+        start = time.monotonic()
+        try:
+            result = getattr(self.proxy(), method)(self.session, *args)
+        except Exception as e:
+            metrics.record_command([method], time.monotonic() - start, None, endpoint=self.endpoint_name())
+            raise Exception("Error while calling {0} (reason : {1})".format(method, e))
+        # responses are [success, result or error message, error code, ...]
+        size = len(result[1]) if isinstance(result[1], str) else None
+        metrics.record_command([method], time.monotonic() - start, 0 if result[0] else result[2], size, endpoint=self.endpoint_name())
+        if not result[0]:
+            raise Exception("Error while calling {0} (error code : {1}, message: {2})".format(method, result[2], result[1]))
+        return result[1]
+
+    def user_info_xml(self):
+        try:
+            return self.call("one.user.info", -1)
+        except Exception as e:
+            raise Exception("Error while fetching user information, try to log in using `oneuser login your_user_name --force` first (reason : {0})".format(e))
+
+    @contextlib.contextmanager
+    def vm_pool_stream(self, owner, id_range=None):
+        flag = int(owner) if owner.isdigit() else self.LIST_OWNERS[owner]
+        start, end = id_range if id_range is not None else (-1, -1)
+        result = self.call("one.vmpool.info", flag, start, end, self.LIST_STATE)
+        yield io.BytesIO(result.encode())
+
+    def pool_ids(self, cache, method, *args):
+        # name to ID lookup tables, fetched once per backend instance
+        with self.lock:
+            if cache not in self.lookups:
+                root = ElementTree.fromstring(self.call(method, *args))
+                self.lookups[cache] = {
+                    elem.find("NAME").text: int(elem.find("ID").text)
+                    for elem in root
+                }
+            return self.lookups[cache]
+
+    def group_id(self, group):
+        if str(group).isdigit():
+            return int(group)
+        try:
+            return self.pool_ids("groups", "one.grouppool.info")[group]
+        except KeyError:
+            raise Exception("Unknown group {0}".format(group))
+
+    def template_id(self, template):
+        if str(template).isdigit():
+            return int(template)
+        try:
+            return self.pool_ids("templates", "one.templatepool.info", -2, -1, -1)[template]
+        except KeyError:
+            raise Exception("Unknown template {0}".format(template))
+
+    def permission_bits(self, permissions):
+        if len(permissions) != 3 or not permissions.isdigit():
+            raise Exception("Invalid permissions {0}, expected octal like '640'".format(permissions))
+        return [
+            1 if int(digit) & bit else 0
+            for digit in permissions
+            for bit in self.PERMISSION_BITS
+        ]
+
+    def resize_template(self, cpu_percent, vcpu_count, mem_mb):
+        lines = []
+        if cpu_percent is not None:
+            lines.append("CPU={0}".format(self.quote(cpu_percent)))
+        if vcpu_count is not None:
+            lines.append("VCPU={0}".format(self.quote(vcpu_count)))
+        if mem_mb is not None:
+            lines.append("MEMORY={0}".format(self.quote(mem_mb)))
+        return "\n".join(lines)
+
+    def multicall(self, calls, retry=True, partial=False):
+        # several calls in a single HTTP round trip, using system.multicall ;
+        # partial : the error of each failed call is returned in place of its
+        # result, rather than raised
+        if len(calls) == 1 and not partial:
+            return [self.call(*calls[0], retry=retry)]
+        return self.guard.run("system.multicall {0}".format(calls[0][0]), lambda: self.multicall_once(calls, partial),
+            all(call[0] not in self.UNREPEATABLE_COMMANDS for call in calls), retry)
+
+    def multicall_once(self, calls, partial=False):
+        if self.session is None:
+            self.session = self.read_session()
+        methods = [call[0] for call in calls]
+        logging.debug("XML-RPC multicall: {0}".format(calls))
+        multicall = xmlrpc.client.MultiCall(self.proxy())
+        for method, *args in calls:
+            getattr(multicall, method)(self.session, *args)
+        start = time.monotonic()
+        try:
+            results = list(multicall())
+        except Exception as e:
+            metrics.record_command(["system.multicall", *methods], time.monotonic() - start, None, endpoint=self.endpoint_name())
+            raise Exception("Error while calling {0} (reason : {1})".format(methods, e))
+        errors = [
+            "{0} (error code : {1}, message: {2})".format(method, result[2], result[1])
+            if not result[0] else None
+            for method, result in zip(methods, results)
+        ]
+        failed = [error for error in errors if error is not None]
+        metrics.record_command(["system.multicall", *methods], time.monotonic() - start, len(failed), endpoint=self.endpoint_name())
+        if partial:
+            return [
+                Exception("Error while calling {0}".format(error)) if error is not None else result[1]
+                for error, result in zip(errors, results)
+            ]
+        if len(failed) > 0:
+            raise Exception("Error while calling {0}".format("; ".join(failed)))
+        return [result[1] for result in results]
+
+    def vm_apply_update(self, vm_info, group, permissions, cpu_percent, vcpu_count, mem_mb):
+        calls = []
+        if group is not None:
+            calls.append(("one.vm.chown", vm_info.id, -1, self.group_id(group)))
+        if permissions is not None:
+            calls.append(("one.vm.chmod", vm_info.id, *self.permission_bits(permissions)))
+        if cpu_percent is not None or vcpu_count is not None or mem_mb is not None:
+            calls.append(("one.vm.resize", vm_info.id, self.resize_template(cpu_percent, vcpu_count, mem_mb), False))
+        self.multicall(calls)
+
+    def host_pool_xml(self):
+        return self.call("one.hostpool.info")
+
+    def template_xml(self, template):
+        return self.call("one.template.info", self.template_id(template), False)
+
+    def user_input_problems(self, template, values):
+        # any value fits in the extra template
+        return []
+
+    def vm_allocate(self, vm_info):
+        if vm_info.one_template is None:
+            # hold in case the image boots using PXE
+            return self.call("one.vm.allocate", self.vm_template(vm_info), True)
+        template = self.template_info(vm_info.one_template)
+        # user inputs are plain attributes of the extra template
+        extra = [self.vm_template(vm_info, with_name=False)]
+        for user_input, value in template.user_input_values(vm_info.user_inputs):
+            extra.append("{0}={1}".format(user_input.name, self.quote(value)))
+        return self.call("one.template.instantiate",
+            template.id,
+            vm_info.name,
+            True,
+            "\n".join(extra),
+            False)
+
+    def vm_destroy(self, vm_info):
+        logging.debug("Destroying vm: {0}".format(vm_info))
+        with self.changing():
+            self.call("one.vm.action", "terminate-hard", vm_info.id)
+
+    def vm_show(self, vm_id):
+        return VmInfo.from_one_xml(ElementTree.fromstring(self.call("one.vm.info", vm_id, False)))
+
+    def vm_nic_attach(self, vm_info, network):
+        self.call("one.vm.attachnic", vm_info.id, self.nic_template(network))
+
+    def vm_nic_detach(self, vm_info, nic_id):
+        self.call("one.vm.detachnic", vm_info.id, nic_id)
+
+    def vm_disk_attach(self, vm_info, disk):
+        self.call("one.vm.attach", vm_info.id, self.disk_template(disk))
+
+    def vm_disk_detach(self, vm_info, disk_id):
+        self.call("one.vm.detach", vm_info.id, disk_id)
+
+    def vm_disk_resize(self, vm_info, disk_id, size_mb):
+        # the size is a string, as it may exceed 32 bits integers
+        self.call("one.vm.diskresize", vm_info.id, disk_id, str(size_mb))
+
+    def vm_destroy_batch(self, vm_infos, owner):
+        # system.multicall tells which calls failed, the listing is only
+        # needed when the whole request did
+        try:
+            results = self.multicall([("one.vm.action", "terminate-hard", vm_info.id) for vm_info in vm_infos], retry=False, partial=True)
+        except Exception as e:
+            logging.warning("Terminating {0} VM at once failed, checking them one by one (reason : {1})".format(len(vm_infos), e))
+            return self.vm_destroy_survivors(vm_infos, owner, e)
+        return {
+            vm_info.id: result if isinstance(result, Exception) else None
+            for vm_info, result in zip(vm_infos, results)
+        }
+
+    def vm_release(self, vm_info):
+        logging.debug("Releasing vm: {0}".format(vm_info))
+        with self.changing():
+            self.call("one.vm.action", "release", vm_info.id)
+
+    def __init__(self, endpoint=None, auth=None, session=None):
+        super().__init__(endpoint, auth)
+        self.session = session
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.lookups = {}
@@ -1,102 +1,356 @@
+import contextlib
 import logging
 import os
 import re
 import subprocess
+import tempfile
+import threading
+import time
 import xml.etree.ElementTree as ElementTree
+from concurrent.futures import ThreadPoolExecutor
 
+from .callguard import CallGuard
+from .capacity import HostCapacity
+from .metrics import CountingReader, metrics
+from .templateinfo import TemplateInfo
+from .topology import TopologyEdit
+from .tracker import StateTracker
 from .vminfo import VmInfo
 
 class OpenNebula:
 
     ENV_ONEXMLRPC="ONE_XMLRPC"
 
+    ENV_ONEAUTH="ONE_AUTH"
+
+    DEFAULT_ONEAUTH="~/.one/one_auth"
+
     ONE_COMMANDS=["oneuser", "onevm", "onetemplate"]
 
+    # listing scopes, mapped to the `onevm list` filter flag
+    LIST_OWNERS={"all": "a", "mine": "m", "group": "g", "primary-group": "G"}
+
+    # VM terminated by a single command or call
+    DESTROY_BATCH=100
+
+    # listing, as named in retries and metrics
+    VM_POOL_COMMAND="onevm list"
+
+    # commands creating or attaching something, that a timeout may have let
+    # through : they are only sent again when OpenNebula refused them
+    UNREPEATABLE_COMMANDS=["onevm create", "onetemplate instantiate", "one.vm.allocate", "one.template.instantiate",
+        "onevm nic-attach", "onevm disk-attach", "one.vm.attachnic", "one.vm.attach"]
+
+    # see https://docs.opennebula.org/5.4/operation/references/vm_states.html,
+    # LCM states of a VM while a NIC or disk is attached, detached or resized :
+    # HOTPLUG, HOTPLUG_NIC, HOTPLUG_PROLOG_POWEROFF, HOTPLUG_EPILOG_POWEROFF,
+    # DISK_RESIZE, DISK_RESIZE_POWEROFF, DISK_RESIZE_UNDEPLOYED and
+    # HOTPLUG_NIC_POWEROFF
+    HOTPLUG_LCM_STATES=[17, 25, 33, 34, 62, 63, 64, 65]
+
+    # seconds between two checks, and before giving up
+    HOTPLUG_POLL=1
+
+    HOTPLUG_TIMEOUT=300
+
     @staticmethod
-    def command_implicit_enter(name, *args):
-        command = [name, *args]
-        logging.debug("Command with implicit 'enter' on STDIN: {0}".format(command))
+    def quote(value):
+        return '"{0}"'.format(str(value).replace("\\", "\\\\").replace('"', '\\"'))
+
+    @staticmethod
+    def split_owner(name):
+        # "owner[name]" is how foreign images/networks are referenced
+        if name.endswith("]") and "[" in name:
+            owner, name = name[:-1].split("[", 1)
+            return owner, name
+        return None, name
+
+    @classmethod
+    def nic_template(cls, network):
+        owner, name = cls.split_owner(network)
+        nic_attrs = ["NETWORK={0}".format(cls.quote(name))]
+        if owner is not None:
+            nic_attrs.append("NETWORK_UNAME={0}".format(cls.quote(owner)))
+        return "NIC=[{0}]".format(", ".join(nic_attrs))
+
+    @classmethod
+    def disk_template(cls, disk):
+        owner, name = cls.split_owner(disk.image)
+        disk_attrs = ["IMAGE={0}".format(cls.quote(name))]
+        if owner is not None:
+            disk_attrs.append("IMAGE_UNAME={0}".format(cls.quote(owner)))
+        if disk.size_mb:
+            disk_attrs.append("SIZE={0}".format(cls.quote(disk.size_mb)))
+        if disk.dev_prefix:
+            disk_attrs.append("DEV_PREFIX={0}".format(cls.quote(disk.dev_prefix)))
+        return "DISK=[{0}]".format(", ".join(disk_attrs))
+
+    def run_measured(self, command, **kwargs):
+        # subprocess.run, recording wall time, exit code and output sizes
+        start = time.monotonic()
         try:
-            result = subprocess.run(command, input=b"\n", stderr=subprocess.PIPE, stdout=subprocess.PIPE)
+            result = subprocess.run(command, env=self.env, **kwargs)
         except Exception as e:
+            metrics.record_command(command, time.monotonic() - start, None, endpoint=self.endpoint_name())
             raise Exception("Error while running command {0} (reason : {1})".format(command, e))
-        if result.returncode != 0:
-            raise Exception("Error while running command {0} (return code : {1}, stdout: {2}, stderr: {3})".format(command, result.returncode, result.stdout, result.stderr))
-        logging.debug("STDOUT: {0}".format(result.stdout))
-        return result.stdout.decode()
+        metrics.record_command(command, time.monotonic() - start, result.returncode,
+            len(result.stdout) if result.stdout is not None else None,
+            len(result.stderr) if result.stderr is not None else None,
+            self.endpoint_name())
+        return result
 
-    @staticmethod
-    def command(name, *args):
+    def command(self, name, *args, retry=True):
+        description = " ".join([name, *args[:1]])
+        return self.guard.run(description, lambda: self.command_once(name, *args),
+            description not in self.UNREPEATABLE_COMMANDS, retry)
+
+    def command_once(self, name, *args):
+        # never interactive, a prompt gets end of file
         command = [name, *args]
         logging.debug("Command: {0}".format(command))
-        try:
-            result = subprocess.run(command, stdin=subprocess.DEVNULL, stderr=subprocess.PIPE, stdout=subprocess.PIPE)
-        except Exception as e:
-            raise Exception("Error while running command {0} (reason : {1})".format(command, e))
+        result = self.run_measured(command, stdin=subprocess.DEVNULL, stderr=subprocess.PIPE, stdout=subprocess.PIPE)
         if result.returncode != 0:
             raise Exception("Error while running command {0} (return code : {1}, stdout: {2}, stderr: {3})".format(command, result.returncode, result.stdout, result.stderr))
         # logging.debug("STDOUT: {0}".format(result.stdout))
         return result.stdout.decode()
 
-    @classmethod
-    def verify_environment(cls):
-        endpoint = os.environ.get(cls.ENV_ONEXMLRPC)
+    @contextlib.contextmanager
+    def command_stream(self, name, *args):
+        # like command, but hands out STDOUT as a pipe while the command runs
+        command = [name, *args]
+        logging.debug("Command (streamed): {0}".format(command))
+        start = time.monotonic()
+        with tempfile.TemporaryFile() as stderr:
+            try:
+                process = subprocess.Popen(command, stdin=subprocess.DEVNULL, stderr=stderr, stdout=subprocess.PIPE, env=self.env)
+            except Exception as e:
+                metrics.record_command(command, time.monotonic() - start, None, endpoint=self.endpoint_name())
+                raise Exception("Error while running command {0} (reason : {1})".format(command, e))
+            stdout = CountingReader(process.stdout)
+            killed = False
+            with process:
+                try:
+                    yield stdout
+                except Exception as e:
+                    # a failing command usually yields truncated output, its
+                    # exit status is reported along with the parse error ; a
+                    # command still running shortly after, rather than just
+                    # exiting, is stopped, its output being wrong
+                    try:
+                        process.wait(timeout=1)
+                    except subprocess.TimeoutExpired:
+                        process.kill()
+                        process.wait()
+                        killed = True
+                    error = e
+                else:
+                    stdout.read()
+                    error = None
+            metrics.record_command(command, time.monotonic() - start, process.returncode,
+                stdout.count, os.fstat(stderr.fileno()).st_size, self.endpoint_name())
+            if error is not None and (killed or process.returncode == 0):
+                raise Exception("Error while reading the output of command {0} (reason : {1})".format(command, error))
+            if process.returncode != 0:
+                stderr.seek(0)
+                raise Exception("Error while running command {0} (return code : {1}, stderr: {2}, reason : {3})".format(command, process.returncode, stderr.read(), error))
+
+    def verify_environment(self):
+        endpoint = self.endpoint_name()
         if endpoint is None:
-            raise Exception("Undefined environment variable {0}, define it with : export {0}=\"http://your_opennebula_host:2633/RPC2\"".format(cls.ENV_ONEXMLRPC))
+            raise Exception("Undefined environment variable {0}, define it with : export {0}=\"http://your_opennebula_host:2633/RPC2\"".format(self.ENV_ONEXMLRPC))
         else:
-            logging.info("Using {0}={1} to commicate with OpenNebula".format(cls.ENV_ONEXMLRPC, endpoint))
+            logging.info("Using {0}={1} to commicate with OpenNebula".format(self.ENV_ONEXMLRPC, endpoint))
 
-    @classmethod
-    def verify_commands(cls):
-        for command in cls.ONE_COMMANDS:
-            retult = None
+    def verify_commands(self):
+        for command in self.ONE_COMMANDS:
             try:
-                result = subprocess.run([command, "--version"], stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL)
+                result = self.run_measured([command, "--version"], stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL)
             except Exception as e:
-                raise Exception("Error while running command (reason : {0})".format(command, e))
+                raise Exception("Error while running command (reason : {0})".format(e))
             logging.debug("Command '{0}' found, returned {1}".format(command, result.returncode))
 
-    def set_user_info(self):
+    def auth_path(self):
+        if self.auth is not None:
+            return os.path.expanduser(self.auth)
+        return os.path.expanduser(os.environ.get(self.ENV_ONEAUTH, self.DEFAULT_ONEAUTH))
+
+    def read_session(self):
+        path = self.auth_path()
         try:
-            result = self.command("oneuser", "show", "--xml")
+            with open(path) as fileobj:
+                session = fileobj.read().strip()
+        except Exception as e:
+            raise Exception("Could not read OpenNebula credentials from {0}, try to log in using `oneuser login your_user_name --force` first (reason : {1})".format(path, e))
+        if ":" not in session:
+            raise Exception("Invalid OpenNebula credentials in {0}, expected 'user:password'".format(path))
+        return session
+
+    def endpoint_name(self):
+        if self.endpoint is not None:
+            return self.endpoint
+        return os.environ.get(self.ENV_ONEXMLRPC)
+
+    def user_name(self):
+        try:
+            return self.read_session().split(":", 1)[0]
+        except Exception:
+            return None
+
+    def changed(self):
+        # drops cached listings
+        if self.cache is not None:
+            self.cache.invalidate()
+
+    @contextlib.contextmanager
+    def changing(self):
+        # around any modification : cached listings are dropped before, and
+        # again once it is over, failed or not, as a listing taken meanwhile
+        # may have been cached
+        self.changed()
+        try:
+            yield
+        finally:
+            self.changed()
+
+    def user_info_xml(self):
+        try:
+            return self.command("oneuser", "show", "--xml")
         except Exception as e:
             raise Exception("Error while running command, try to log in using `oneuser login your_user_name --force` first (reason : {0})".format(e))
-        root = ElementTree.fromstring(result)
+
+    def set_user_info(self):
+        root = ElementTree.fromstring(self.user_info_xml())
         # logging.debug("XML: {0}".format(ElementTree.tostring(root)))
         self.uid = int(root.find("ID").text)
         self.gid = int(root.find("GID").text)
         logging.info("User has a valid authorization token (uid={0} gid={0})".format(self.uid, self.gid))
 
-    def vm_set_group(self, vm_info, group):
-        logging.debug("Setting group {0} for vm : {1}".format(group, vm_info))
+    @staticmethod
+    def resize_args(cpu_percent, vcpu_count, mem_mb):
+        args = []
+        if cpu_percent is not None:
+            args.append("--cpu")
+            args.append(str(cpu_percent))
+        if vcpu_count is not None:
+            args.append("--vcpu")
+            args.append(str(vcpu_count))
+        if mem_mb is not None:
+            args.append("--memory")
+            args.append(str(mem_mb))
+        return args
+
+    def commands_parallel(self, commands):
+        # independent commands, run at the same time rather than one after the other
+        if len(commands) == 1:
+            return [self.command(*commands[0])]
+        with ThreadPoolExecutor(max_workers=len(commands)) as executor:
+            futures = [executor.submit(self.command, *command) for command in commands]
+        errors = []
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                errors.append(str(e))
+        if len(errors) > 0:
+            raise Exception("; ".join(errors))
+        return results
+
+    def vm_apply_update(self, vm_info, group, permissions, cpu_percent, vcpu_count, mem_mb):
+        # the CLI has one command per change, they are pipelined
+        commands = []
+        if group is not None:
+            commands.append(["onevm", "chgrp", str(vm_info.id), group])
+        if permissions is not None:
+            commands.append(["onevm", "chmod", str(vm_info.id), permissions])
+        resize_args = self.resize_args(cpu_percent, vcpu_count, mem_mb)
+        if len(resize_args) > 0:
+            commands.append(["onevm", "resize", *resize_args, str(vm_info.id)])
         try:
-            result = self.command("onevm", "chgrp", str(vm_info.id), group)
+            self.commands_parallel(commands)
         except Exception as e:
             raise Exception("Error while running command (reason : {0})".format(e))
 
+    def vm_update(self, vm_info, group=None, permissions=None, cpu_percent=None, vcpu_count=None, mem_mb=None):
+        # group, permissions and capacity of a VM, changed all together
+        logging.debug("Updating vm : {0} (group={1}, permissions={2}, cpu={3}, vcpu={4}, mem_mb={5})".format(vm_info, group, permissions, cpu_percent, vcpu_count, mem_mb))
+        resize = cpu_percent is not None or vcpu_count is not None or mem_mb is not None
+        # enforce state requirements, see https://docs.opennebula.org/5.4/operation/references/vm_states.html
+        if resize and vm_info.state not in StateTracker.RESIZABLE_STATES:
+            # group and permissions do not depend on the state
+            self.vm_update(vm_info, group, permissions)
+            raise Exception("VM {0} is in a state ({1}) where its envelope cannot be modified".format(vm_info.id, vm_info.state))
+        if group is None and permissions is None and not resize:
+            return
+        with self.changing():
+            self.vm_apply_update(vm_info, group, permissions, cpu_percent, vcpu_count, mem_mb)
+        if resize:
+            logging.info("Resizing VM {0} done".format(vm_info.id))
+
+    def vm_set_group(self, vm_info, group):
+        logging.debug("Setting group {0} for vm : {1}".format(group, vm_info))
+        self.vm_update(vm_info, group=group)
+
     def vm_set_permissions(self, vm_info, permissions):
         logging.debug("Setting permissions {0} for vm : {1}".format(permissions, vm_info))
-        try:
-            result = self.command("onevm", "chmod", str(vm_info.id), permissions)
-        except Exception as e:
-            raise Exception("Error while running command (reason : {0})".format(e))
+        self.vm_update(vm_info, permissions=permissions)
 
-    def vm_list(self):
-        vms = {}
+    def vm_pool_stream(self, owner, id_range=None):
+        # onevm list cannot restrict on ID, id_range is only a hint
+        # DONE VM are never listed by onevm
+        if owner.isdigit():
+            return self.command_stream("onevm", "list", "--xml", owner)
+        return self.command_stream("onevm", "list", "--xml", self.LIST_OWNERS[owner])
+
+    def vm_list(self, name_filter=None, owner="all", id_range=None):
+        # owner and state filtering happens server-side, the name filter is
+        # applied while parsing as OpenNebula cannot match a name prefix
+        def list_once():
+            vms = {}
+            try:
+                with self.vm_pool_stream(owner, id_range) as stream:
+                    for vm in VmInfo.iterparse_one_xml(stream, name_filter):
+                        vms[vm.name] = vm
+            except Exception as e:
+                raise Exception("Error while listing VM (reason : {0})".format(e))
+            # logging.debug("VM list: {0}".format(vms))
+            return vms
+        return self.guard.run(self.VM_POOL_COMMAND, list_once)
+
+    def host_pool_xml(self):
+        return self.command("onehost", "list", "--xml")
+
+    def host_capacity(self):
+        # hosts VM can be deployed to and their free CPU and memory, empty
+        # when the user may not list them
         try:
-            result = self.command("onevm", "list", "--xml")
+            return HostCapacity.from_pool_xml(ElementTree.fromstring(self.host_pool_xml()))
         except Exception as e:
-            raise Exception("Error while running command (reason : {0})".format(e))
-        root = ElementTree.fromstring(result)
-        # logging.debug("XML: {0}".format(ElementTree.tostring(root)))
-        for vm_elem in root.findall("VM"):
-            vm = VmInfo.from_one_xml(vm_elem)
-            vms[vm.name] = vm
-        # logging.debug("VM list: {0}".format(vms))
-        return vms
+            logging.warning("Could not list hosts, releasing VM regardless of capacity (reason : {0})".format(e))
+            return []
 
-    def vm_create(self, vm_info):
-        logging.debug("Creating vm: {0}".format(vm_info))
+    def template_xml(self, template):
+        return self.command("onetemplate", "show", "--xml", str(template))
+
+    def template_info(self, template):
+        # templates are fetched once per run, whatever the number of VMs using them
+        with self.templates_lock:
+            if template not in self.templates:
+                try:
+                    self.templates[template] = TemplateInfo.from_one_xml(ElementTree.fromstring(self.template_xml(template)))
+                except Exception as e:
+                    raise Exception("Error while fetching template {0} (reason : {1})".format(template, e))
+            return self.templates[template]
+
+    def user_input_problems(self, template, values):
+        # values the backend cannot pass on, as the CLI takes them as a list
+        return [
+            "user input {0} contains a comma, which onetemplate cannot take, use the xmlrpc backend".format(user_input.name)
+            for user_input, value in template.user_input_values(values)
+            if "," in value
+        ]
+
+    def vm_allocate(self, vm_info):
         args = ["--name", vm_info.name,
                 "--hold", # in case one_template uses PXE implicitely
                 "--cpu", str(vm_info.cpu),
@@ -118,11 +372,15 @@ class OpenNebula:
             if vm_info.one_template is None:
                 result = self.command("onevm", "create", *args)
             else:
-                logging.warning("Creation of VM {0} from a template might require a prompt. In that case, this tool chooses the default entry (ie simulates 'enter')")
-                result = self.command_implicit_enter("onetemplate", "instantiate", *args, vm_info.one_template)
+                # every user input is given by name, so that none is prompted for
+                template = self.template_info(vm_info.one_template)
+                values = {user_input.name: value for user_input, value in template.user_input_values(vm_info.user_inputs)}
+                if len(template.user_inputs) > 0:
+                    args.append("--user-inputs")
+                    args.append(",".join(user_input.cli_argument(values.get(user_input.name)) for user_input in template.user_inputs))
+                result = self.command("onetemplate", "instantiate", *args, vm_info.one_template)
         except Exception as e:
             raise Exception("Error while running command (reason : {0})".format(e))
-        # store vm id number
         if vm_info.one_template is None:
             # onevm output
             r = r'^ID: (\d+)$'
@@ -132,49 +390,111 @@ class OpenNebula:
         m = re.search(r, result)
         if not m:
             raise Exception("Could not detect VM id after creation")
-        vm_info.id = int(m.group(1))
-        # set group
-        if vm_info.group is not None:
-            self.vm_set_group(vm_info, vm_info.group)
-        # permissions
-        if vm_info.permissions is not None:
-            self.vm_set_permissions(vm_info, vm_info.permissions)
+        return int(m.group(1))
+
+    def vm_create(self, vm_info):
+        logging.debug("Creating vm: {0}".format(vm_info))
+        with self.changing():
+            # store vm id number
+            vm_info.id = self.vm_allocate(vm_info)
+            # capacity is part of the creation, group and permissions are not
+            self.vm_update(vm_info, vm_info.group, vm_info.permissions)
 
     def vm_destroy(self, vm_info):
         logging.debug("Destroying vm: {0}".format(vm_info))
+        with self.changing():
+            try:
+                self.command("onevm", "terminate", "--hard", str(vm_info.id))
+            except Exception as e:
+                raise Exception("Error while running command (reason : {0})".format(e))
+
+    @staticmethod
+    def id_list(ids):
+        # onevm takes a range "first..last" or a comma separated list
+        ids = sorted(ids)
+        if len(ids) > 1 and ids[-1] - ids[0] == len(ids) - 1:
+            return "{0}..{1}".format(ids[0], ids[-1])
+        return ",".join(str(vm_id) for vm_id in ids)
+
+    def vm_destroy_batch(self, vm_infos, owner):
+        # {ID: None or error} of a batch, not retried as a whole :
+        # vm_destroy_many retries the VM left
         try:
-            result = self.command("onevm", "terminate", "--hard", str(vm_info.id))
+            self.command("onevm", "terminate", "--hard", self.id_list(vm_info.id for vm_info in vm_infos), retry=False)
         except Exception as e:
-            raise Exception("Error while running command (reason : {0})".format(e))
+            logging.warning("Terminating {0} VM at once failed, checking them one by one (reason : {1})".format(len(vm_infos), e))
+            return self.vm_destroy_survivors(vm_infos, owner, e)
+        return {vm_info.id: None for vm_info in vm_infos}
+
+    def vm_destroy_survivors(self, vm_infos, owner, error):
+        # {ID: None or error} after a failed batch, when OpenNebula does not
+        # tell which VM failed : those still listed in the state they were
+        # in are left, as OpenNebula changes it when accepting the action.
+        # A VM whose state changed on its own while its termination was
+        # refused is wrongly taken as terminated, and not tried again.
+        names = set(vm_info.name for vm_info in vm_infos)
+        ids = [vm_info.id for vm_info in vm_infos]
+        try:
+            listed = self.vm_list(lambda name: name in names, owner, (min(ids), max(ids)))
+        except Exception as e:
+            logging.warning("Could not list VM left by the batch (reason : {0})".format(e))
+            return {vm_info.id: error for vm_info in vm_infos}
+        return {
+            vm_info.id: error if vm_info.name in listed
+                and listed[vm_info.name].id == vm_info.id
+                and (listed[vm_info.name].state, listed[vm_info.name].lcm_state) == (vm_info.state, vm_info.lcm_state)
+                else None
+            for vm_info in vm_infos
+        }
+
+    def vm_destroy_many(self, vm_infos, owner="all", done=None):
+        # terminate VM in batches, then one by one those a batch left
+        # behind ; returns {name: None or error}, done(vm_info, error,
+        # seconds) being called once the outcome of each VM is known
+        logging.debug("Destroying {0} vm".format(len(vm_infos)))
+        results = {}
+        def finish(vm_info, error, start):
+            results[vm_info.name] = error
+            if done is not None:
+                done(vm_info, error, time.monotonic() - start)
+        vm_infos = sorted(vm_infos, key=lambda vm_info: vm_info.id)
+        with self.changing():
+            for first in range(0, len(vm_infos), self.DESTROY_BATCH):
+                batch = vm_infos[first:first + self.DESTROY_BATCH]
+                start = time.monotonic()
+                failed = self.vm_destroy_batch(batch, owner)
+                for vm_info in batch:
+                    if failed[vm_info.id] is None:
+                        finish(vm_info, None, start)
+                for vm_info in batch:
+                    if failed[vm_info.id] is None:
+                        continue
+                    try:
+                        self.vm_destroy(vm_info)
+                        error = None
+                    except Exception as e:
+                        error = e
+                    finish(vm_info, error, start)
+        return results
+
+    def vm_release(self, vm_info):
+        logging.debug("Releasing vm: {0}".format(vm_info))
+        with self.changing():
+            try:
+                self.command("onevm", "release", str(vm_info.id))
+            except Exception as e:
+                raise Exception("Error while running command (reason : {0})".format(e))
 
     def vm_resize(self, vm_info, cpu_percent=None, vcpu_count=None, mem_mb=None):
         logging.debug("Resizing vm : {0}".format(vm_info))
-        # setup args
-        args = []
-        if cpu_percent is not None:
-            args.append("--cpu")
-            args.append(str(cpu_percent))
-        if vcpu_count is not None:
-            args.append("--vcpu")
-            args.append(str(vcpu_count))
-        if mem_mb is not None:
-            args.append("--memory")
-            args.append(str(mem_mb))
         # skip early if noop
-        if len(args) == 0:
+        if cpu_percent is None and vcpu_count is None and mem_mb is None:
             logging.info("No difference in vcpu/cpu/mem detected, not resizing VM {0}".format(vm_info.id))
             return
-        # enforce state requirements, see https://docs.opennebula.org/5.4/operation/references/vm_states.html
-        if vm_info.state not in [2, 4, 5, 8, 9]:
-            raise Exception("VM {0} is in a state ({1}) where its envelope cannot be modified".format(vm_info.id, vm_info.state))
-        # actual resize operation
-        try:
-            result = self.command("onevm", "resize", *args, str(vm_info.id))
-        except Exception as e:
-            raise Exception("Error while running command (reason : {0})".format(e))
-        logging.info("Resizing VM {0} done".format(vm_info.id))
+        self.vm_update(vm_info, cpu_percent=cpu_percent, vcpu_count=vcpu_count, mem_mb=mem_mb)
 
-    def vm_synchronize(self, vm_info, differences):
+    def vm_synchronize(self, vm_info, differences, hotplug=False):
+        # hotplug : attach and detach NIC and disks rather than only warning
         logging.debug("Synchronizing vm : {0}".format(vm_info))
         # group
         try:
@@ -183,8 +503,6 @@ class OpenNebula:
             group = None
         if group is not None:
             group = group[1]
-            if group is not None:
-                self.vm_set_group(vm_info, group)
         # permissions
         try:
             permissions = differences['permissions']
@@ -192,8 +510,6 @@ class OpenNebula:
             permissions = None
         if permissions is not None:
             permissions = permissions[1]
-            if permissions is not None:
-                self.vm_set_permissions(vm_info, permissions)
         # resize
         cpu_percent = vcpu_count = mem_mb = None
         try:
@@ -214,31 +530,128 @@ class OpenNebula:
             mem_mb = None
         if mem_mb is not None:
             mem_mb = mem_mb[1]
-        self.vm_resize(vm_info, cpu_percent, vcpu_count, mem_mb)
-        # updating VM definition following resize
+        # a single update for all of them
+        self.vm_update(vm_info, group, permissions, cpu_percent, vcpu_count, mem_mb)
+        # updating VM definition following update
+        if group is not None:
+            vm_info.group = group
+        if permissions is not None:
+            vm_info.permissions = permissions
         if cpu_percent is not None:
             vm_info.cpu = cpu_percent
         if vcpu_count is not None:
             vm_info.vcpu = vcpu_count
         if mem_mb is not None:
             vm_info.mem_mb = mem_mb
+        vm_info.invalidate_fingerprint()
         logging.debug("VM infos post resize {0}".format(vm_info))
         # disks
         try:
             disks = differences['disks']
         except KeyError:
             disks = None
-        if disks is not None:
-            logging.warning("Changing disk topology could lead to data loss, so this function is not implemented and modifications should be done manually")
+        if disks is not None and not hotplug:
+            logging.warning("Changing disk topology could lead to data loss, so it is only done with --hotplug, otherwise modifications should be done manually")
         # networks
         try:
             networks = differences['networks']
         except KeyError:
             networks = None
+        if networks is not None and not hotplug:
+            logging.warning("Changing network topology could break the network configuration of the guest (lose mac/ip leases, change interface names) so it is only done with --hotplug, otherwise modifications should be done by hand")
+        if hotplug and (disks is not None or networks is not None):
+            self.vm_reconcile_topology(vm_info,
+                networks[1] if networks is not None else None,
+                disks[1] if disks is not None else None)
+
+    def vm_show(self, vm_id):
+        return VmInfo.from_one_xml(ElementTree.fromstring(self.command("onevm", "show", str(vm_id), "--xml")))
+
+    def vm_template_command(self, vm_info, command, template):
+        # onevm nic-attach and disk-attach read vector attributes from a file
+        with tempfile.NamedTemporaryFile("w", suffix=".one") as fileobj:
+            fileobj.write(template)
+            fileobj.flush()
+            self.command("onevm", command, str(vm_info.id), "--file", fileobj.name)
+
+    def vm_nic_attach(self, vm_info, network):
+        self.vm_template_command(vm_info, "nic-attach", self.nic_template(network))
+
+    def vm_nic_detach(self, vm_info, nic_id):
+        self.command("onevm", "nic-detach", str(vm_info.id), str(nic_id))
+
+    def vm_disk_attach(self, vm_info, disk):
+        self.vm_template_command(vm_info, "disk-attach", self.disk_template(disk))
+
+    def vm_disk_detach(self, vm_info, disk_id):
+        self.command("onevm", "disk-detach", str(vm_info.id), str(disk_id))
+
+    def vm_disk_resize(self, vm_info, disk_id, size_mb):
+        self.command("onevm", "disk-resize", str(vm_info.id), str(disk_id), str(size_mb))
+
+    def vm_wait_hotplug(self, vm_info):
+        # one hotplug operation at a time : the next one is refused while
+        # the VM is in a hotplug state
+        deadline = time.monotonic() + self.HOTPLUG_TIMEOUT
+        while True:
+            current = self.vm_show(vm_info.id)
+            if current.lcm_state not in self.HOTPLUG_LCM_STATES:
+                return current
+            if time.monotonic() + self.HOTPLUG_POLL > deadline:
+                raise Exception("VM {0} still in state {1}/{2} after {3}s of hotplug".format(vm_info.id, current.state, current.lcm_state, self.HOTPLUG_TIMEOUT))
+            time.sleep(self.HOTPLUG_POLL)
+
+    def vm_reconcile_topology(self, vm_info, networks, disks):
+        # networks and disks of the definition, None when they do not differ ;
+        # every edit is computed before anything is changed
+        operations = []
         if networks is not None:
-            logging.warning("Changing network topology could break the network configuration of the guest (lose mac/ip leases, change interface names) so this function is not implemented and modifications should be done by hand")
+            edit = TopologyEdit.for_networks(vm_info.networks, vm_info.nic_ids, networks)
+            logging.debug("NIC edit for vm {0}: {1}".format(vm_info.id, edit))
+            operations.extend((self.vm_nic_detach, nic_id) for nic_id in edit.detach)
+            operations.extend((self.vm_nic_attach, network) for network in edit.attach)
+        if disks is not None:
+            edit = TopologyEdit.for_disks(vm_info.disks, disks)
+            logging.debug("Disk edit for vm {0}: {1}".format(vm_info.id, edit))
+            operations.extend((self.vm_disk_detach, disk_id) for disk_id in edit.detach)
+            operations.extend((self.vm_disk_resize, disk_id, size_mb) for disk_id, size_mb in edit.resize)
+            operations.extend((self.vm_disk_attach, disk) for disk in edit.attach)
+        if len(operations) == 0:
+            return
+        with self.changing():
+            for operation, *args in operations:
+                logging.info("Hotplug on VM {0}: {1} {2}".format(vm_info.id, operation.__name__, args))
+                operation(vm_info, *args)
+                current = self.vm_wait_hotplug(vm_info)
+        # what OpenNebula did, rather than what was asked
+        vm_info.networks = current.networks
+        vm_info.nic_ids = current.nic_ids
+        vm_info.disks = current.disks
+        vm_info.state = current.state
+        vm_info.lcm_state = current.lcm_state
+        vm_info.invalidate_fingerprint()
+        # compared like the edits, definitions may leave sizes and prefixes out
+        if (networks is not None and len(TopologyEdit.for_networks(vm_info.networks, vm_info.nic_ids, networks)) > 0) or (
+                disks is not None and len(TopologyEdit.for_disks(vm_info.disks, disks)) > 0):
+            raise Exception("VM {0} NIC or disks still differ after hotplug (networks {1}, disks {2})".format(
+                vm_info.id, list(vm_info.networks), list(vm_info.disks)))
 
-    def __init__(self):
-        pass
+    def __init__(self, endpoint=None, auth=None):
+        # endpoint and credentials file, defaulting to the environment
+        self.endpoint = endpoint
+        self.auth = auth
+        self.env = None
+        if endpoint is not None or auth is not None:
+            # given to every CLI command
+            self.env = dict(os.environ)
+            if endpoint is not None:
+                self.env[self.ENV_ONEXMLRPC] = endpoint
+            if auth is not None:
+                self.env[self.ENV_ONEAUTH] = self.auth_path()
+        self.cache = None
+        # retries, in-flight limit and circuit breaker, see App.backend
+        self.guard = CallGuard(self.endpoint_name())
+        self.templates = {}
+        self.templates_lock = threading.Lock()
 
 
@@ -0,0 +1,94 @@
+import json
+import logging
+
+from .vmdisk import VmDisk
+
+class PlanStep:
+
+    def __init__(self, action, vm_name, platform_name, vm_id=None, differences=None, target=None):
+        self.action = action
+        self.vm_name = vm_name
+        self.platform_name = platform_name
+        self.vm_id = vm_id
+        self.differences = differences
+        self.target = target
+
+    def __repr__(self):
+        return "PlanStep(action={0}, vm_name={1}, platform_name={2}, vm_id={3}, differences={4})".format(self.action, self.vm_name, self.platform_name, self.vm_id, self.differences)
+
+    def tostring(self):
+        if self.action == "create":
+            disks = self.target.disks or []
+            return "+ {0}: create cpu {1}, vcpu {2}, mem_mb {3}, networks [{4}], disks [{5}]{6}".format(
+                self.vm_name, self.target.cpu, self.target.vcpu, self.target.mem_mb,
+                ", ".join(self.target.networks or []),
+                ", ".join(disk.to_arg() for disk in disks),
+                "".join(
+                    ", {0} {1}".format(key, value)
+                    for key, value in [("group", self.target.group), ("permissions", self.target.permissions), ("one_template", self.target.one_template)]
+                    if value is not None))
+        if self.action == "update":
+            return "~ {0}: ID {1}, {2}".format(self.vm_name, self.vm_id, ", ".join(
+                "changing {0} from {1} to {2}".format(key, change[0], change[1])
+                for key, change in self.differences.items()))
+        return "- {0}: ID {1}, destroy".format(self.vm_name, self.vm_id)
+
+class Plan:
+
+    # execution order : destroying first frees names and capacity, updates
+    # come last as they do not depend on anything else
+    ACTIONS=["destroy", "create", "update"]
+
+    @staticmethod
+    def jsonable(value):
+        if isinstance(value, VmDisk):
+            return {"image": value.image, "size_mb": value.size_mb, "dev_prefix": value.dev_prefix}
+        if isinstance(value, (list, tuple)):
+            return [Plan.jsonable(x) for x in value]
+        return value
+
+    def __init__(self):
+        self.steps = []
+
+    def add(self, step):
+        logging.debug("Planned {0}".format(step))
+        self.steps.append(step)
+
+    def steps_for(self, action):
+        return [step for step in self.steps if step.action == action]
+
+    def summary(self):
+        return "Plan: {0} to create, {1} to update, {2} to destroy".format(
+            len(self.steps_for("create")), len(self.steps_for("update")), len(self.steps_for("destroy")))
+
+    def tostring(self):
+        lines = [
+            step.tostring()
+            for step in sorted(self.steps, key=lambda step: (step.vm_name, self.ACTIONS.index(step.action)))
+        ]
+        lines.append(self.summary())
+        return "\n".join(lines)
+
+    def save(self, path):
+        steps = []
+        for step in sorted(self.steps, key=lambda step: (self.ACTIONS.index(step.action), step.vm_name)):
+            entry = {"action": step.action, "name": step.vm_name, "platform": step.platform_name, "id": step.vm_id}
+            if step.differences is not None:
+                entry["differences"] = {key: self.jsonable(change) for key, change in step.differences.items()}
+            if step.target is not None:
+                entry["target"] = {
+                    "cpu_percent": step.target.cpu,
+                    "vcpu_count": step.target.vcpu,
+                    "mem_mb": step.target.mem_mb,
+                    "arch": step.target.arch,
+                    "boot": step.target.boot,
+                    "networks": self.jsonable(step.target.networks),
+                    "disks": self.jsonable(step.target.disks),
+                    "one_template": step.target.one_template,
+                    "group": step.target.group,
+                    "permissions": step.target.permissions,
+                }
+            steps.append(entry)
+        with open(path, "w") as fileobj:
+            json.dump({"steps": steps}, fileobj, indent=4)
+        logging.info("Plan written to {0}".format(path))
@@ -0,0 +1,27 @@
+class Platform:
+
+    def __init__(self, name, is_domain=False, jsonfile=None, target=None, endpoint=None, one_auth=None):
+        self.name = name
+        self.is_domain = is_domain
+        self.jsonfile = jsonfile
+        self.target = target if target is not None else {}
+        # OpenNebula frontend and credentials file, None for the environment
+        self.endpoint = endpoint
+        self.one_auth = one_auth
+        # VM names belonging to the platform start with the prefix, or end
+        # with the suffix for domains ; see NameIndex for exact ownership
+        self.prefix = None
+        self.suffix = None
+        if self.is_domain:
+            self.suffix = ".{0}".format(self.name)
+        else:
+            self.prefix = "{0}-".format(self.name)
+
+    def __repr__(self):
+        return "Platform(name={0}, is_domain={1}, jsonfile={2}, endpoint={3})".format(self.name, self.is_domain, self.jsonfile, self.endpoint)
+
+    def owns(self, vm_name):
+        # the name looks like ours, a longer platform name may still claim it
+        if self.is_domain:
+            return vm_name.endswith(self.suffix)
+        return vm_name.startswith(self.prefix)
@@ -0,0 +1,92 @@
+import json
+import sys
+import threading
+
+from .plan import Plan
+
+class Reporter:
+
+    # text lines for each outcome, "{name}: {outcome}" otherwise ; None when
+    # nothing is printed
+    TEXT_FORMATS={
+        "created": "{name}: created ID {id}",
+        "destroyed": "{name}: destroyed ID {id}",
+        "present": "{name}: present ID {id}",
+        "unreferenced": "{name}: unreferenced ID {id}",
+        "failed": "{name}: failed ({error})",
+        "unchanged": None,
+        "resizable": None,
+    }
+
+    def __init__(self, output="text", stream=None):
+        # text : the lines printed so far, in a stable order once an action
+        # is done ; ndjson : one JSON object per line, written and flushed
+        # as soon as each VM is done
+        self.output = output
+        self.stream = stream
+        self.lock = threading.Lock()
+
+    @property
+    def streaming(self):
+        return self.output == "ndjson"
+
+    @staticmethod
+    def record(action, outcome, name, vm_info=None, differences=None, seconds=None, error=None, skipped=None):
+        return {
+            "name": name,
+            "action": action,
+            "outcome": outcome,
+            "id": vm_info.id if vm_info is not None else None,
+            "state": vm_info.state if vm_info is not None else None,
+            "lcm_state": vm_info.lcm_state if vm_info is not None else None,
+            "differences": differences,
+            "skipped": skipped,
+            "seconds": seconds,
+            "error": str(error) if error is not None else None,
+        }
+
+    @staticmethod
+    def wave(endpoint, wave, waves, released, remaining_seconds=None):
+        # progress of a release in waves, rather than of a VM
+        return {
+            "action": "release",
+            "outcome": "wave",
+            "endpoint": endpoint,
+            "wave": wave,
+            "waves": waves,
+            "released": released,
+            "remaining_seconds": remaining_seconds,
+        }
+
+    def text(self, record):
+        if record["outcome"] == "wave":
+            return "{0}: wave {1}/{2}, releasing {3} VM, {4}".format(
+                record["endpoint"], record["wave"], record["waves"], record["released"],
+                "remaining time unknown" if record["remaining_seconds"] is None
+                else "about {0:.0f}s remaining".format(record["remaining_seconds"]))
+        if record["outcome"] in ["synchronized", "partial"]:
+            return "{0}: ID {1}, {2}".format(record["name"], record["id"], ", ".join(
+                ["changing {0} from {1} to {2}".format(key, change[0], change[1])
+                for key, change in record["differences"].items()]
+                + ["not changing {0} from {1} to {2} without --hotplug".format(key, change[0], change[1])
+                for key, change in (record["skipped"] or {}).items()]))
+        text_format = self.TEXT_FORMATS.get(record["outcome"], "{name}: {outcome}")
+        if text_format is None:
+            return None
+        return text_format.format(**record)
+
+    def emit(self, record):
+        stream = self.stream if self.stream is not None else sys.stdout
+        if self.streaming:
+            for field in ["differences", "skipped"]:
+                if record.get(field) is not None:
+                    record = dict(record, **{field: {key: Plan.jsonable(change) for key, change in record[field].items()}})
+            line = json.dumps(record, sort_keys=True)
+            with self.lock:
+                stream.write(line + "\n")
+                stream.flush()
+            return
+        line = self.text(record)
+        if line is not None:
+            with self.lock:
+                print(line, file=stream)
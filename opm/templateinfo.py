@@ -0,0 +1,94 @@
+import logging
+
+class TemplateInfo:
+
+    @staticmethod
+    def from_one_xml(template_elem):
+        # <VMTEMPLATE>
+        #   <ID>0</ID>
+        #   <NAME>ttylinux</NAME>
+        #   <TEMPLATE>
+        #     <USER_INPUTS> *optional*
+        #       <ROOT_PASSWORD><![CDATA[M|password|Root password| |]]></ROOT_PASSWORD> *many*
+        #     </USER_INPUTS>
+        #   </TEMPLATE>
+        # </VMTEMPLATE>
+        template = TemplateInfo()
+        # extract id
+        value = template_elem.find("ID")
+        if value is not None:
+            template.id = int(value.text)
+        # extract name
+        value = template_elem.find("NAME")
+        if value is not None:
+            template.name = value.text
+        # extract user inputs, "M|type|description|options|default", in
+        # the template order
+        for input_elem in template_elem.findall("TEMPLATE/USER_INPUTS/*"):
+            fields = (input_elem.text or "").split("|")
+            fields += [""] * (5 - len(fields))
+            template.user_inputs.append(TemplateUserInput(
+                input_elem.tag,
+                fields[0] == "M",
+                fields[1],
+                fields[2],
+                [option for option in fields[3].split(",") if option.strip() != ""],
+                fields[4] if fields[4].strip() != "" else None))
+        logging.debug("Parsed: {0}".format(template))
+        return template
+
+    def __init__(self, template_id=None, name=None, user_inputs=None):
+        self.id = template_id
+        self.name = name
+        self.user_inputs = user_inputs if user_inputs is not None else []
+
+    def __repr__(self):
+        return "TemplateInfo(id={0}, name={1}, user_inputs={2})".format(self.id, self.name, self.user_inputs)
+
+    def check_user_inputs(self, values):
+        problems = []
+        names = set(user_input.name for user_input in self.user_inputs)
+        for name in sorted(set(values or {}).difference(names)):
+            problems.append("template {0} has no user input {1}".format(self.name, name))
+        for user_input in self.user_inputs:
+            value = (values or {}).get(user_input.name)
+            if value is not None and user_input.type == "list" and str(value) not in user_input.options:
+                problems.append("template {0} user input {1} must be one of {2}".format(self.name, user_input.name, user_input.options))
+            if user_input.mandatory and user_input.default is None and user_input.name not in (values or {}):
+                problems.append("template {0} requires user input {1} ({2})".format(self.name, user_input.name, user_input.description))
+        return problems
+
+    def user_input_values(self, values):
+        # ordered (user input, value) pairs, using defaults if needed ;
+        # optional inputs with neither a value nor a default are left out
+        return [
+            (user_input, str((values or {}).get(user_input.name, user_input.default)))
+            for user_input in self.user_inputs
+            if user_input.name in (values or {}) or user_input.default is not None
+        ]
+
+class TemplateUserInput:
+
+    def __init__(self, name, mandatory, input_type, description, options, default):
+        self.name = name
+        self.mandatory = mandatory
+        self.type = input_type
+        self.description = description
+        self.options = options
+        self.default = default
+
+    def __repr__(self):
+        return "TemplateUserInput(name={0}, mandatory={1}, type={2}, description={3}, options={4}, default={5})".format(self.name, self.mandatory, self.type, self.description, self.options, self.default)
+
+    def cli_argument(self, value=None):
+        # NAME=value item of the comma separated --user-inputs list of
+        # onetemplate instantiate, list inputs taking the option itself ;
+        # None answers an optional input left out with nothing, so that
+        # it is not prompted for
+        if value is None:
+            return "{0}=".format(self.name)
+        if self.type == "list" and value not in self.options:
+            raise Exception("Invalid value {0} for user input {1}, expected one of {2}".format(value, self.name, self.options))
+        if "," in value:
+            raise Exception("The value of user input {0} contains a comma, which onetemplate cannot take, use the xmlrpc backend".format(self.name))
+        return "{0}={1}".format(self.name, value)
@@ -0,0 +1,81 @@
+class TopologyEdit:
+
+    # changes turning the NIC or disks of an existing VM into those of its
+    # definition, without recreating it.
+    #
+    # OpenNebula gives attached NIC and disks the next free ID, so that they
+    # always come after the existing ones : the only lists that can be
+    # reached are the current one with some items detached, followed by
+    # attached items. The edit keeps the longest prefix of the target found
+    # in order in the current list, which is the smallest number of detach
+    # and attach operations reaching the target.
+
+    def __init__(self):
+        # IDs to detach, items to attach in order, (ID, size) to grow
+        self.detach = []
+        self.attach = []
+        self.resize = []
+
+    def __len__(self):
+        return len(self.detach) + len(self.attach) + len(self.resize)
+
+    def __repr__(self):
+        return "TopologyEdit(detach={0}, attach={1}, resize={2})".format(self.detach, self.attach, self.resize)
+
+    @staticmethod
+    def kept(current, target, matches):
+        # [(current index, target index)] of the target prefix found in order
+        # in current, matched leftmost
+        pairs = []
+        position = 0
+        for target_index, item in enumerate(target):
+            while position < len(current) and not matches(current[position], item):
+                position += 1
+            if position == len(current):
+                break
+            pairs.append((position, target_index))
+            position += 1
+        return pairs
+
+    @classmethod
+    def for_networks(cls, networks, nic_ids, target):
+        edit = cls()
+        pairs = cls.kept(networks, target, lambda current, wanted: current == wanted)
+        kept = set(pair[0] for pair in pairs)
+        edit.detach = [nic_ids[index] for index in range(len(networks)) if index not in kept]
+        edit.attach = list(target[len(pairs):])
+        return edit
+
+    @staticmethod
+    def same_disk(current, wanted):
+        # same image and device prefix, OpenNebula filling the prefix when the
+        # definition leaves it out
+        return current.image == wanted.image and (wanted.dev_prefix is None or current.dev_prefix == wanted.dev_prefix)
+
+    @classmethod
+    def for_disks(cls, disks, target):
+        # disks match with same_disk, a larger size is a resize ; the first
+        # disk, the VM boots from it, is never detached
+        def matches(current, wanted):
+            return cls.same_disk(current, wanted) and (
+                wanted.size_mb is None or current.size_mb is None or wanted.size_mb >= current.size_mb)
+        edit = cls()
+        pairs = cls.kept(disks, target, matches)
+        if len(disks) > 0 and (len(pairs) == 0 or pairs[0] != (0, 0)):
+            raise Exception("The root disk ({0}) differs from the definition ({1}), the VM must be recreated".format(
+                disks[0].to_arg(), target[0].to_arg() if len(target) > 0 else "none"))
+        kept = set(pair[0] for pair in pairs)
+        for current_index, target_index in pairs:
+            current = disks[current_index]
+            wanted = target[target_index]
+            if wanted.size_mb is not None and current.size_mb is not None and wanted.size_mb > current.size_mb:
+                edit.resize.append((current.disk_id, wanted.size_mb))
+        shrunk = [
+            disk.to_arg() for index, disk in enumerate(disks)
+            if index not in kept and any(cls.same_disk(disk, wanted) for wanted in target[len(pairs):])
+        ]
+        if len(shrunk) > 0:
+            raise Exception("Disks cannot be shrunk, nor moved ({0}), the VM must be recreated".format(", ".join(shrunk)))
+        edit.detach = [disks[index].disk_id for index in range(len(disks)) if index not in kept]
+        edit.attach = list(target[len(pairs):])
+        return edit
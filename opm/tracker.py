@@ -0,0 +1,168 @@
+import asyncio
+import logging
+
+from .capacity import WavePlan
+
+class StateTracker:
+
+    # see https://docs.opennebula.org/5.4/operation/references/vm_states.html
+    # name: (STATE, LCM_STATE or None for any)
+    STATES={
+        "pending": (1, None),
+        "hold": (2, None),
+        "active": (3, None),
+        "running": (3, 3),
+        "stopped": (4, None),
+        "suspended": (5, None),
+        "poweroff": (8, None),
+        "undeployed": (9, None),
+    }
+
+    # states where the VM envelope can be modified
+    RESIZABLE_STATES=[2, 4, 5, 8, 9]
+
+    FAILURE_STATES=[7]
+
+    @classmethod
+    def reached(cls, vm_info, state_name):
+        state, lcm_state = cls.STATES[state_name]
+        return vm_info.state == state and (lcm_state is None or vm_info.lcm_state == lcm_state)
+
+    def __init__(self, one, owner="all", interval=5, jobs=1):
+        self.one = one
+        self.owner = owner
+        self.interval = interval
+        self.jobs = jobs
+
+    async def call(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+    async def poll(self, vms):
+        # a single listing for every tracked VM, restricted to their ID range
+        if len(vms) == 0:
+            return {}
+        names = set(vm.name for vm in vms)
+        ids = [vm.id for vm in vms]
+        listed = await self.call(self.one.vm_list, lambda name: name in names, self.owner, (min(ids), max(ids)))
+        return {vm.id: vm for vm in listed.values()}
+
+    async def release_all(self, vms, done=None):
+        loop = asyncio.get_running_loop()
+        limit = asyncio.Semaphore(self.jobs)
+        async def release(vm):
+            async with limit:
+                start = loop.time()
+                try:
+                    await self.call(self.one.vm_release, vm)
+                    error = None
+                except Exception as e:
+                    error = e
+                if done is not None:
+                    done(vm, error, loop.time() - start)
+                return error
+        results = await asyncio.gather(*[release(vm) for vm in vms])
+        return {vm.name: result for vm, result in zip(vms, results)}
+
+    @classmethod
+    def deployed(cls, vm_info):
+        # placed by the scheduler and done with its transfers and boot
+        return vm_info.state != cls.STATES["pending"][0] and not (
+            vm_info.state == cls.STATES["active"][0] and vm_info.lcm_state != cls.STATES["running"][1])
+
+    async def release_waves_all(self, vms, timeout, done=None, progress=None):
+        # releases vms in waves the hosts have room for, each one once the
+        # former is deployed, progress(wave, waves, released, remaining
+        # seconds or None) being called as each starts ; {name: None or
+        # error} like release_all
+        loop = asyncio.get_running_loop()
+        # CPU and memory as OpenNebula allocated them, template defaults included
+        listed = await self.poll(vms)
+        demands = {vm.name: WavePlan.demand(listed.get(vm.id, vm)) for vm in vms}
+        hosts = await self.call(self.one.host_capacity)
+        if len(hosts) == 0:
+            return await self.release_all(vms, done)
+        # planned once, from this single listing
+        plan = WavePlan(hosts).pack(vms, demands)
+        results = {}
+        # VM that can never fit are reported before anything is released
+        for vm in plan.unplaced:
+            error = Exception("VM {0} needs {1} CPU and {2} MB, more than {3}, left on hold".format(
+                vm.id, *demands[vm.name],
+                "any host has" if plan.oversized(demands[vm.name]) else "the hosts have left once the other VM are placed"))
+            results[vm.name] = error
+            if done is not None:
+                done(vm, error, 0.0)
+        start = loop.time()
+        for index, wave in enumerate(plan.waves):
+            if progress is not None:
+                progress(index + 1, len(plan.waves), len(wave),
+                    (len(plan.waves) - index) * (loop.time() - start) / index if index > 0 else None)
+            released = await self.release_all(wave, done)
+            results.update(released)
+            if index + 1 == len(plan.waves):
+                break
+            # the next wave is released once this one is placed, VM that
+            # failed to release are already reported
+            deployed = await self.wait_all([vm for vm in wave if released[vm.name] is None], self.deployed, "deployed", timeout)
+            for vm_name, error in sorted(deployed.items()):
+                if error is not None:
+                    logging.warning("{0}: released, but {1}".format(vm_name, error))
+        return results
+
+    async def wait_all(self, vms, predicate, description, timeout, done=None):
+        # returns {name: None or the reason why the VM did not get there},
+        # done(vm, error, seconds) being called as soon as each VM is
+        if len(vms) == 0:
+            return {}
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        deadline = start + timeout
+        pending = {vm.id: vm for vm in vms}
+        results = {}
+        def finish(vm, error):
+            results[vm.name] = error
+            del pending[vm.id]
+            if done is not None:
+                done(vm, error, loop.time() - start)
+        while True:
+            current = await self.poll(list(pending.values()))
+            for vm_id, vm in list(pending.items()):
+                if vm_id not in current:
+                    finish(vm, Exception("VM {0} disappeared while waiting for {1}".format(vm_id, description)))
+                    continue
+                # keep callers' objects up to date
+                vm.state = current[vm_id].state
+                vm.lcm_state = current[vm_id].lcm_state
+                if predicate(vm):
+                    finish(vm, None)
+                elif vm.state in self.FAILURE_STATES:
+                    finish(vm, Exception("VM {0} failed (state {1}) while waiting for {2}".format(vm_id, vm.state, description)))
+            if len(pending) == 0:
+                break
+            if loop.time() + self.interval > deadline:
+                for vm in list(pending.values()):
+                    finish(vm, Exception("VM {0} still in state {1}/{2} after {3}s waiting for {4}".format(vm.id, vm.state, vm.lcm_state, timeout, description)))
+                break
+            logging.info("Waiting for {0} VM to be {1}".format(len(pending), description))
+            await asyncio.sleep(self.interval)
+        return results
+
+    def release(self, vms, done=None):
+        if len(vms) == 0:
+            return {}
+        return asyncio.run(self.release_all(vms, done))
+
+    def release_waves(self, vms, timeout, done=None, progress=None):
+        if len(vms) == 0:
+            return {}
+        return asyncio.run(self.release_waves_all(vms, timeout, done, progress))
+
+    def wait(self, vms, state_name, timeout, done=None):
+        if len(vms) == 0:
+            return {}
+        return asyncio.run(self.wait_all(vms, lambda vm: self.reached(vm, state_name), state_name, timeout, done))
+
+    def wait_resizable(self, vms, timeout, done=None):
+        if len(vms) == 0:
+            return {}
+        return asyncio.run(self.wait_all(vms, lambda vm: vm.state in self.RESIZABLE_STATES, "resizable", timeout, done))
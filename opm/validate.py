@@ -0,0 +1,179 @@
+import hashlib
+import json
+import logging
+
+from .app import App
+from .cache import InventoryCache
+from .metrics import metrics
+from .nameindex import NameIndex
+from .platform import Platform
+
+def check_definition(jsonfile, content, args):
+    # runs in a worker process : every problem of one definition file, and
+    # the VM names it defines when it loads ; whatever happens, a result
+    try:
+        return check_content(content, args)
+    except Exception as e:
+        return {"platform_name": None, "platform_is_domain": False, "vm_names": [],
+            "errors": [{"type": "invalid-definition", "message": "{0}: {1}".format(e.__class__.__name__, e)}]}
+
+def check_content(content, args):
+    result = {"platform_name": None, "platform_is_domain": False, "vm_names": [], "errors": []}
+    def error(kind, message):
+        result["errors"].append({"type": kind, "message": message})
+    try:
+        jdata = json.loads(content)
+        if not isinstance(jdata, dict):
+            raise ValueError("expected an object")
+    except ValueError as e:
+        error("invalid-json", "Invalid JSON (reason : {0})".format(e))
+        return result
+    platform_name = jdata.get('platform_name')
+    if not isinstance(platform_name, str) or len(platform_name.strip()) == 0:
+        error("empty-platform-name", "Platform name cannot be empty")
+    else:
+        result["platform_name"] = platform_name.strip()
+        result["platform_is_domain"] = bool(jdata.get('platform_is_domain', False))
+    # classes and hosts must be objects of objects for the checks below
+    classes = jdata.get('classes') or {}
+    hosts = jdata.get('hosts') or {}
+    for key, value in [("classes", classes), ("hosts", hosts)]:
+        if not isinstance(value, dict):
+            error("invalid-definition", "{0} must be an object".format(key))
+            continue
+        for name, definition in sorted(value.items()):
+            if not isinstance(definition, dict):
+                error("invalid-definition", "{0} {1} must be an object".format(key, name))
+            elif not isinstance(definition.get('class'), (str, type(None))):
+                error("invalid-definition", "The class of {0} {1} must be a name".format(key, name))
+    if len(result["errors"]) > 0:
+        return result
+    # unknown classes, all of them rather than the first one met
+    for class_name, definition in sorted(classes.items()):
+        parent = definition.get('class')
+        if parent is not None and parent not in classes:
+            error("unknown-class", "Unknown class {0} referenced by class {1}".format(parent, class_name))
+    for vm_name, definition in sorted(hosts.items()):
+        vm_class = definition.get('class')
+        if vm_class is not None and vm_class not in classes:
+            error("unknown-class", "Unknown class {0} referenced by host {1}".format(vm_class, vm_name))
+    # class cycles, each reported once
+    reported = set()
+    for class_name in sorted(classes):
+        chain = []
+        current = class_name
+        while current in classes and current not in chain:
+            chain.append(current)
+            current = classes[current].get('class')
+        if current in chain:
+            cycle = chain[chain.index(current):]
+            if frozenset(cycle) not in reported:
+                reported.add(frozenset(cycle))
+                error("class-cycle", "Cyclic class reference: {0}".format(" -> ".join(cycle + [current])))
+    if len(result["errors"]) > 0:
+        return result
+    # anything else is reported by the regular loading
+    try:
+        result["vm_names"] = sorted(App(args).load_definition(jdata))
+    except Exception as e:
+        error("invalid-definition", "{0}".format(e))
+    return result
+
+class Validator:
+
+    # bumped whenever check_definition reports differently, to drop results
+    # cached by former versions
+    CACHE_VERSION=3
+
+    def __init__(self, args):
+        self.args = args
+        self.cache = None
+        if not self.args.no_cache:
+            # results only depend on file contents, they never expire
+            self.cache = InventoryCache(float("inf"), "validate", None, self.args.cache_dir)
+
+    def check_all(self, contents):
+        # {jsonfile: result}, cached results first, then a process pool
+        results = {}
+        pending = []
+        for jsonfile, content in contents.items():
+            digest = hashlib.sha256(content).hexdigest()
+            cached = self.cache.get(("validate", self.CACHE_VERSION, digest)) if self.cache is not None else None
+            if cached is not None:
+                results[jsonfile] = dict(cached, digest=digest, cached=True)
+            else:
+                pending.append((jsonfile, content, digest))
+        logging.info("Validating {0} definition files, {1} unchanged".format(len(contents), len(results)))
+        if self.args.jobs > 1 and len(pending) > 1:
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(max_workers=self.args.jobs) as executor:
+                checked = list(executor.map(check_definition,
+                    [item[0] for item in pending],
+                    [item[1] for item in pending],
+                    [self.args] * len(pending),
+                    chunksize=max(1, len(pending) // (self.args.jobs * 4))))
+        else:
+            checked = [check_definition(jsonfile, content, self.args) for jsonfile, content, digest in pending]
+        for (jsonfile, content, digest), result in zip(pending, checked):
+            if self.cache is not None:
+                self.cache.put(("validate", self.CACHE_VERSION, digest), result)
+            results[jsonfile] = dict(result, digest=digest, cached=False)
+        return results
+
+    def collisions(self, results):
+        # VM names defined by several files, or defined by one file but
+        # falling under the longer platform name of another
+        names = NameIndex()
+        for jsonfile, result in results.items():
+            if result["platform_name"] is not None:
+                names.add(Platform(result["platform_name"], result["platform_is_domain"], jsonfile), result["vm_names"])
+        return [
+            {"vm_name": vm_name, "files": sorted(set(platform.jsonfile for platform in platforms))}
+            for vm_name, platforms in names.collisions()
+        ]
+
+    def run(self):
+        contents = {}
+        unreadable = {}
+        for jsonfile in self.args.jsonfile:
+            try:
+                with open(jsonfile, "rb") as fileobj:
+                    contents[jsonfile] = fileobj.read()
+            except Exception as e:
+                unreadable[jsonfile] = {"platform_name": None, "platform_is_domain": False, "vm_names": [], "digest": None, "cached": False,
+                    "errors": [{"type": "unreadable", "message": "Could not read file (reason : {0})".format(e)}]}
+        with metrics.phase("validate"):
+            results = self.check_all(contents)
+            results.update(unreadable)
+            collisions = self.collisions(results)
+        for collision in collisions:
+            for jsonfile in collision["files"]:
+                results[jsonfile]["errors"].append({"type": "name-collision",
+                    "message": "VM {0} is also claimed by {1}".format(collision["vm_name"],
+                        ", ".join(other for other in collision["files"] if other != jsonfile))})
+        report = {
+            "files": [
+                {
+                    "file": jsonfile,
+                    "digest": results[jsonfile]["digest"],
+                    "cached": results[jsonfile]["cached"],
+                    "platform_name": results[jsonfile]["platform_name"],
+                    "vm_count": len(results[jsonfile]["vm_names"]),
+                    "errors": results[jsonfile]["errors"],
+                }
+                for jsonfile in self.args.jsonfile
+            ],
+            "collisions": collisions,
+            "summary": {
+                "files": len(results),
+                "cached": sum(1 for result in results.values() if result["cached"]),
+                "invalid": sum(1 for result in results.values() if len(result["errors"]) > 0),
+                "collisions": len(collisions),
+            },
+        }
+        print(json.dumps(report, indent=4, sort_keys=True))
+        return {
+            jsonfile: result["errors"]
+            for jsonfile, result in results.items()
+            if len(result["errors"]) > 0
+        }
@@ -1,12 +1,19 @@
 import logging
+import sys
 #import xml.etree.ElementTree as ElementTree
 
 class VmDisk:
 
-    def __init__(self, image=None, size_mb=None, dev_prefix=None):
+    # disks are compared by value, disk_id being only known for existing VM
+    # and not part of the value ; they are mutable hence not hashable, hash
+    # key() instead, as VmInfo.fingerprint does
+    __slots__ = ("image", "size_mb", "dev_prefix", "disk_id")
+
+    def __init__(self, image=None, size_mb=None, dev_prefix=None, disk_id=None):
         self.image = image
         self.size_mb = size_mb
         self.dev_prefix = dev_prefix
+        self.disk_id = disk_id
 
     def __repr__(self):
         return "VmDisk(image={0}, size_mb={1}, dev_prefix={2})".format(self.image, self.size_mb, self.dev_prefix)
@@ -24,7 +31,7 @@ class VmDisk:
         # logging.debug("Before override disk : {0}".format(self))
         # logging.debug("Overriding disk with : {0}".format(params))
         try:
-            self.image = params['image']
+            self.image = sys.intern(params['image']) if params['image'] is not None else None
             # logging.debug("image overridden to {0}".format(self.image))
         except KeyError:
             pass
@@ -60,6 +67,7 @@ class VmDisk:
         #     <SIZE><![CDATA[256]]></SIZE>
         #     <IMAGE_UNAME><![CDATA[serveradmin]]></IMAGE_UNAME>
         #     <DEV_PREFIX><![CDATA[256]]></DEV_PREFIX>
+        #     <DISK_ID>0</DISK_ID>
         disk = VmDisk()
         # logging.debug("Xml: {0}".format(ElementTree.tostring(disk_elem)))
         # extract image
@@ -70,6 +78,8 @@ class VmDisk:
         value = disk_elem.find("IMAGE_UNAME")
         if value is not None:
             disk.image = "{0}[{1}]".format(value.text, disk.image)
+        if disk.image is not None:
+            disk.image = sys.intern(disk.image)
         # extract size
         value = disk_elem.find("SIZE")
         if value is not None:
@@ -78,23 +88,21 @@ class VmDisk:
         value = disk_elem.find("DEV_PREFIX")
         if value is not None:
             disk.dev_prefix = value.text
+        # extract disk_id
+        value = disk_elem.find("DISK_ID")
+        if value is not None:
+            disk.disk_id = int(value.text)
         # return constructed
         # logging.debug("Parsed: {0}".format(disk))
         return disk
 
+    def key(self):
+        return (self.image, self.size_mb, self.dev_prefix)
+
     def __eq__(self, other):
         # logging.debug("Comparing {0} == {1}".format(self, other))
-        # image must be defined
-        if self.image is None or other.image is None:
-            raise Exception("A disk must be based on an image")
-        if self.image != other.image:
-            return False
-        if self.size_mb != other.size_mb:
-            return False
-        return self.dev_prefix == other.dev_prefix
-
-    def __ne__(self, other):
-        # logging.debug("Comparing {0} != {1}".format(self, other))
-        return not self.__eq__(other)
-
+        if not isinstance(other, VmDisk):
+            return NotImplemented
+        return self.key() == other.key()
 
+    __hash__ = None
@@ -1,9 +1,42 @@
 import logging
+import sys
 
 from .vmdisk import VmDisk
 
 class VmInfo:
 
+    # many VM are kept in memory at once, networks and disks are tuples
+    __slots__ = ("name", "cpu", "vcpu", "mem_mb", "arch", "boot", "networks", "disks",
+        "one_template", "group", "permissions", "user_inputs", "id", "state", "lcm_state",
+        "nic_ids", "_fingerprint")
+
+    # NIC_ID tuples, shared like interned strings as most VM have the same
+    SHARED_NIC_IDS={}
+
+    @staticmethod
+    def iterparse_one_xml(source, name_filter=None):
+        # <VM_POOL>
+        #   <VM>...</VM> *many*
+        # </VM_POOL>
+        # VM are handled one at a time as the document is read, and only those
+        # whose name passes name_filter are turned into VmInfo, so that memory
+        # does not grow with the size of the pool
+        import xml.etree.ElementTree as ElementTree
+        root = None
+        depth = 0
+        for event, elem in ElementTree.iterparse(source, events=("start", "end")):
+            if event == "start":
+                if root is None:
+                    root = elem
+                depth += 1
+                continue
+            depth -= 1
+            if depth != 1 or elem.tag != "VM":
+                continue
+            if name_filter is None or name_filter(elem.findtext("NAME", "")):
+                yield VmInfo.from_one_xml(elem)
+            root.remove(elem)
+
     @staticmethod
     def from_one_xml(vm_elem):
         # <VM>
@@ -22,6 +55,7 @@ class VmInfo:
         #     <OTHER_A>0</OTHER_A>
         #   </PERMISSIONS>
         #   <STATE>8</STATE>
+        #   <LCM_STATE>0</LCM_STATE>
         #   <TEMPLATE>
         #     <CPU><![CDATA[0.1]]></CPU>
         #     <DISK> *many*
@@ -100,12 +134,19 @@ class VmInfo:
                 owner = nic_elem.find("NETWORK_UNAME")
                 if owner is not None:
                     name = "{0}[{1}]".format(owner.text, name)
-                vm.networks[order] = name
-            vm.networks = [ vm.networks[key] for key in sorted(vm.networks.keys()) ]
+                vm.networks[order] = sys.intern(name)
+            # NIC_ID of each network, to detach it
+            nic_ids = tuple(sorted(vm.networks.keys()))
+            vm.nic_ids = VmInfo.SHARED_NIC_IDS.setdefault(nic_ids, nic_ids)
+            vm.networks = tuple(vm.networks[key] for key in vm.nic_ids)
         # extract disks
         value = vm_elem.findall("TEMPLATE/DISK")
         if value is not None:
-            vm.disks = [ VmDisk.from_one_xml(x) for x in value ]
+            disks = [VmDisk.from_one_xml(x) for x in value]
+            # attached disks come last, whatever the order of the document
+            if all(disk.disk_id is not None for disk in disks):
+                disks.sort(key=lambda disk: disk.disk_id)
+            vm.disks = tuple(disks)
         # extract one_template
         vm.one_template = None
         # extract id
@@ -116,11 +157,16 @@ class VmInfo:
         value = vm_elem.find("STATE")
         if value is not None:
             vm.state = int(value.text)
+        # extract lcm_state
+        value = vm_elem.find("LCM_STATE")
+        if value is not None:
+            vm.lcm_state = int(value.text)
         # return constructed
-        logging.debug("Parsed: {0}".format(vm))
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug("Parsed: {0}".format(vm))
         return vm
 
-    def __init__(self, name=None, cpu=None, vcpu=None, mem_mb=None, arch=None, boot=None, networks=None, disks=None, one_template=None, group=None, permissions=None, vm_id=None, state=None):
+    def __init__(self, name=None, cpu=None, vcpu=None, mem_mb=None, arch=None, boot=None, networks=None, disks=None, one_template=None, group=None, permissions=None, vm_id=None, state=None, lcm_state=None, user_inputs=None):
         # configuration
         self.name = name
         self.cpu = cpu
@@ -133,12 +179,16 @@ class VmInfo:
         self.one_template = one_template
         self.group = group
         self.permissions = permissions
+        self.user_inputs = user_inputs
         # state
         self.id = vm_id
         self.state = state
+        self.lcm_state = lcm_state
+        self.nic_ids = None
+        self._fingerprint = None
 
     def __repr__(self):
-        return "VmInfo(name={0}, cpu={1}, vcpu={2}, mem_mb={3}, arch={4}, boot={5}, networks={6}, disks={7}, one_template={8}, group={9}, permissions={10}, id={11}, state={12})".format(self.name, self.cpu, self.vcpu, self.mem_mb, self.arch, self.boot, self.networks, self.disks, self.one_template, self.group, self.permissions, self.id, self.state)
+        return "VmInfo(name={0}, cpu={1}, vcpu={2}, mem_mb={3}, arch={4}, boot={5}, networks={6}, disks={7}, one_template={8}, group={9}, permissions={10}, id={11}, state={12}, lcm_state={13}, user_inputs={14})".format(self.name, self.cpu, self.vcpu, self.mem_mb, self.arch, self.boot, self.networks, self.disks, self.one_template, self.group, self.permissions, self.id, self.state, self.lcm_state, self.user_inputs)
 
     def pretty_tostring(self):
         disks = self.disks
@@ -157,7 +207,11 @@ class VmInfo:
             len(self.networks),
             "".join([ "\n\t\t{0}".format(name) for name in self.networks]),
             len(disks),
-            "".join([ "\n\t\t{0}".format(disk.pretty_tostring()) for disk in disks]))
+            "".join([ "\n\t\t{0}".format(disk.pretty_tostring()) for disk in disks])) + (
+            "\n\tuser_inputs: {0}{1}".format(
+                len(self.user_inputs),
+                "".join([ "\n\t\t{0}={1}".format(key, value) for key, value in sorted(self.user_inputs.items())]))
+            if self.user_inputs else "")
 
     def override_config(self, params):
         # logging.debug("Before override vm : {0}".format(self))
@@ -188,7 +242,7 @@ class VmInfo:
         except KeyError:
             pass
         try:
-            self.networks = params['networks']
+            self.networks = tuple(sys.intern(network) for network in params['networks'])
             logging.debug("networks overridden to {0}".format(self.networks))
         except KeyError:
             pass
@@ -197,11 +251,14 @@ class VmInfo:
             if disk_overrides is None:
                 self.disks = None
             else:
-                self.disks = []
+                disks = []
                 for disk_override in disk_overrides:
                     disk = VmDisk()
                     disk.override_config(disk_override)
-                    self.disks.append(disk)
+                    if disk.image is None:
+                        raise Exception("A disk must be based on an image")
+                    disks.append(disk)
+                self.disks = tuple(disks)
             logging.debug("disks overridden to {0}".format(self.disks))
         except KeyError:
             pass
@@ -210,6 +267,11 @@ class VmInfo:
             logging.debug("one_template overridden to {0}".format(self.one_template))
         except KeyError:
             pass
+        try:
+            self.user_inputs = params['user_inputs']
+            logging.debug("user_inputs overridden to {0}".format(self.user_inputs))
+        except KeyError:
+            pass
         try:
             self.group = params['group']
             logging.debug("group overridden to {0}".format(self.group))
@@ -220,14 +282,58 @@ class VmInfo:
             logging.debug("permissions overridden to {0}".format(self.permissions))
         except KeyError:
             pass
+        self.invalidate_fingerprint()
         # logging.debug("After override vm : {0}".format(self))
 
+    def fingerprint(self):
+        # managed configuration but group and permissions, computed once :
+        # equal fingerprints mean there is nothing to resize nor rebuild
+        if self._fingerprint is None:
+            # plain tuples all the way down, hashed and compared without
+            # calling back into VmDisk
+            disks = tuple(disk.key() for disk in self.disks) if self.disks is not None else None
+            config = (self.cpu, self.vcpu, self.mem_mb, self.arch, self.boot, self.networks, disks)
+            self._fingerprint = (hash(config), config)
+        return self._fingerprint
+
+    def config_mask(self, other):
+        # fields compare_config ignores : group, permissions or disks None on
+        # either side
+        return (
+            self.group is None or other.group is None,
+            self.permissions is None or other.permissions is None,
+            self.disks is None or other.disks is None)
+
+    def digest(self, mask):
+        # canonical managed configuration, with the fields of the mask left
+        # out : equal digests under the same mask mean compare_config finds
+        # no difference
+        config = self.fingerprint()[1]
+        return (
+            None if mask[0] else self.group,
+            None if mask[1] else self.permissions,
+            config if not mask[2] else config[:-1])
+
+    def invalidate_fingerprint(self):
+        # to be called whenever the configuration is modified in place
+        self._fingerprint = None
+
+    def signature(self):
+        # changes whenever OpenNebula state or managed configuration changes
+        return (self.id, self.state, self.lcm_state, self.group, self.permissions,
+            self.cpu, self.vcpu, self.mem_mb, self.arch, self.boot,
+            self.networks, self.disks)
+
     def compare_config(self, target):
         differences = {}
         if self.group is not None and target.group is not None and self.group != target.group:
             differences['group'] = [self.group, target.group]
         if self.permissions is not None and target.permissions is not None and self.permissions != target.permissions:
             differences['permissions'] = [self.permissions, target.permissions]
+        fingerprint = self.fingerprint()
+        target_fingerprint = target.fingerprint()
+        if fingerprint[0] == target_fingerprint[0] and fingerprint[1] == target_fingerprint[1]:
+            return differences
         if self.cpu != target.cpu:
             differences['cpu_percent'] = [self.cpu, target.cpu]
         if self.vcpu != target.vcpu:
@@ -239,15 +345,11 @@ class VmInfo:
         if self.boot != target.boot:
             differences['boot'] = [self.boot, target.boot]
         if self.networks != target.networks:
-            differences['networks'] = [self.networks, target.networks]
-        if self.disks is not None and target.disks is not None and len(self.disks) != len(target.disks):
-            differences['disks'] = [self.disks, target.disks]
-        else:
-            if self.disks is not None and target.disks is not None:
-                for x in range(len(self.disks)):
-                    if self.disks[x] != target.disks[x]:
-                        differences['disks'] = [self.disks, target.disks]
-                        break
+            differences['networks'] = [
+                list(networks) if networks is not None else None
+                for networks in (self.networks, target.networks)]
+        if self.disks is not None and target.disks is not None and self.disks != target.disks:
+            differences['disks'] = [list(self.disks), list(target.disks)]
         return differences
 
 
@@ -0,0 +1,33 @@
+import unittest
+
+from opm.capacity import HostCapacity, WavePlan
+from opm.vminfo import VmInfo
+
+class WavePlanTest(unittest.TestCase):
+
+    def plan(self, hosts, vms):
+        return WavePlan(hosts).pack(vms, {vm.name: WavePlan.demand(vm) for vm in vms})
+
+    def test_room_taken_by_former_waves(self):
+        hosts = [HostCapacity(index, "host{0}".format(index), "default", 2, 100, 1024, 100, 1024) for index in range(2)]
+        vms = [VmInfo("vm-{0}".format(index), 0.5, 1, 512, vm_id=index) for index in range(10)]
+        plan = self.plan(hosts, vms)
+        self.assertEqual([len(wave) for wave in plan.waves], [2, 2])
+        self.assertEqual(len(plan.unplaced), 6)
+
+    def test_largest_first(self):
+        hosts = [HostCapacity(0, "host0", "default", 2, 400, 4096, 400, 4096)]
+        vms = [VmInfo("small", 1, 1, 512, vm_id=0), VmInfo("large", 3, 1, 512, vm_id=1), VmInfo("other", 1, 1, 512, vm_id=2)]
+        plan = self.plan(hosts, vms)
+        self.assertEqual([[vm.name for vm in wave] for wave in plan.waves], [["large"], ["other"]])
+        self.assertEqual([vm.name for vm in plan.unplaced], ["small"])
+
+    def test_oversized(self):
+        hosts = [HostCapacity(0, "host0", "default", 2, 800, 4096, 100, 4096)]
+        plan = self.plan(hosts, [VmInfo("big", 16, 1, 512, vm_id=0), VmInfo("busy", 2, 1, 512, vm_id=1)])
+        self.assertEqual(plan.waves, [])
+        self.assertTrue(plan.oversized(WavePlan.demand(plan.unplaced[0])))
+        self.assertFalse(plan.oversized(WavePlan.demand(plan.unplaced[1])))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,29 @@
+import sys
+import unittest
+import xml.etree.ElementTree as ElementTree
+
+from opm.opennebula import OpenNebula
+
+class CommandStreamTest(unittest.TestCase):
+
+    def parse(self, script):
+        with OpenNebula("http://localhost:2633/RPC2").command_stream(sys.executable, "-c", script) as stream:
+            return ElementTree.parse(stream)
+
+    def test_parse_error(self):
+        with self.assertRaisesRegex(Exception, "Error while reading the output .* no element found"):
+            self.parse("print('<VM_POOL><VM>')")
+
+    def test_exit_status(self):
+        with self.assertRaisesRegex(Exception, r"return code : 3, stderr: b'denied\\n'"):
+            self.parse("import sys; print('<VM_POOL><VM>'); sys.stderr.write('denied\\n'); sys.exit(3)")
+
+    def test_still_running(self):
+        with self.assertRaisesRegex(Exception, "Error while reading the output .* not well-formed"):
+            self.parse("import sys, time; print('<' * 200000); sys.stdout.flush(); time.sleep(30)")
+
+    def test_success(self):
+        self.assertEqual(self.parse("print('<VM_POOL/>')").getroot().tag, "VM_POOL")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+import unittest
+
+from opm.onexmlrpc import OneXmlRpc
+from opm.vminfo import VmInfo
+
+class ScriptedOne(OneXmlRpc):
+
+    # system.multicall refusing some terminations, without any listing
+    def __init__(self, refused):
+        super().__init__("http://one.invalid:2633/RPC2", None, "oneadmin:password")
+        self.refused = refused
+        self.destroyed = []
+
+    def multicall_once(self, calls, partial=False):
+        return [
+            Exception("Error while calling one.vm.action (error code : 32768)") if vm_id in self.refused else vm_id
+            for method, action, vm_id in calls
+        ]
+
+    def vm_list(self, name_filter=None, owner="all", id_range=None):
+        raise AssertionError("per-call results need no listing")
+
+    def vm_destroy(self, vm_info):
+        self.destroyed.append(vm_info.id)
+
+class DestroyManyTest(unittest.TestCase):
+
+    def test_failed_calls_retried(self):
+        # the refused VM changed state on its own, it must still be retried
+        vms = [VmInfo("vm-{0}".format(vm_id), vm_id=vm_id, state=3, lcm_state=3) for vm_id in range(5)]
+        one = ScriptedOne(refused=[1, 3])
+        done = []
+        results = one.vm_destroy_many(vms, done=lambda vm, error, seconds: done.append(vm.id))
+        self.assertEqual(one.destroyed, [1, 3])
+        self.assertEqual(results, {vm.name: None for vm in vms})
+        self.assertEqual(sorted(done), list(range(5)))
+
+if __name__ == '__main__':
+    unittest.main()
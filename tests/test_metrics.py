@@ -0,0 +1,42 @@
+import json
+import unittest
+
+from opm.metrics import Metrics
+
+class MetricsTest(unittest.TestCase):
+
+    def record(self, metrics):
+        with metrics.phase("list"):
+            metrics.record_command(["onevm", "list", "--xml"], 0.5, 0, 100, 0, "http://one")
+        metrics.record_command(["onevm", "list", "--xml"], 0.25, 1, 0, 10, "http://one")
+        metrics.record_retry("onevm list", "http://one", "transient")
+
+    def test_totals(self):
+        metrics = Metrics()
+        self.record(metrics)
+        report = json.loads(metrics.to_json())
+        self.assertEqual(report["commands"], [{"command": "onevm list", "endpoint": "http://one", "count": 2, "errors": 1,
+            "retries": 1, "seconds": 0.75, "stdout_bytes": 100, "stderr_bytes": 10}])
+        self.assertEqual(len(report["events"]["commands"]), 2)
+
+    def test_without_events(self):
+        metrics = Metrics()
+        metrics.keep_events = False
+        for _ in range(3):
+            self.record(metrics)
+        self.assertEqual((metrics.phases, metrics.commands, metrics.retries), ([], [], []))
+        report = json.loads(metrics.to_json())
+        self.assertNotIn("events", report)
+        self.assertEqual(report["commands"][0]["count"], 6)
+        self.assertEqual(report["phases"]["list"]["count"], 3)
+
+    def test_prometheus_counters(self):
+        metrics = Metrics()
+        self.record(metrics)
+        lines = metrics.to_prometheus().splitlines()
+        self.assertIn("# TYPE opm_command_calls_total counter", lines)
+        self.assertIn('opm_command_retries_total{command="onevm list",endpoint="http://one"} 1', lines)
+        self.assertIn("# TYPE opm_run_seconds gauge", lines)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import types
+import unittest
+
+from opm.nameindex import NameIndex
+from opm.platform import Platform
+from opm.validate import Validator
+
+class OwnerTest(unittest.TestCase):
+
+    def index(self, *platforms):
+        names = NameIndex()
+        for platform in platforms:
+            names.add(platform, [])
+        return names
+
+    def test_overlapping_prefixes(self):
+        short, long = Platform("a"), Platform("a-b")
+        names = self.index(short, long)
+        self.assertIs(names.owner("a-srv1"), short)
+        self.assertIs(names.owner("a-b-srv1"), long)
+        self.assertIs(names.owner("a-bc-srv1"), short)
+        self.assertIsNone(names.owner("ab-srv1"))
+
+    def test_domain_suffixes(self):
+        domain, sub = Platform("example.com", True), Platform("sub.example.com", True)
+        names = self.index(domain, sub)
+        self.assertIs(names.owner("srv1.example.com"), domain)
+        self.assertIs(names.owner("srv1.sub.example.com"), sub)
+        self.assertIs(names.owner("srv1.othersub.example.com"), domain)
+        self.assertIsNone(names.owner("srv1.example.org"))
+
+    def test_longest_of_prefix_and_suffix(self):
+        prefix, suffix = Platform("web-production"), Platform("example.com", True)
+        names = self.index(prefix, suffix)
+        self.assertIs(names.owner("web-production-srv1.example.com"), prefix)
+        self.assertIs(names.owner("web-production-srv1.com"), prefix)
+        self.assertIs(names.owner("web-srv1.example.com"), suffix)
+
+    def test_same_name_twice(self):
+        names = self.index(Platform("a", jsonfile="one.json"), Platform("a", jsonfile="two.json"))
+        self.assertIsNone(names.owner("a-srv1"))
+        self.assertEqual(len(names.owners("a-srv1")), 2)
+
+class CollisionsTest(unittest.TestCase):
+
+    def collisions(self, results):
+        validator = Validator(types.SimpleNamespace(no_cache=True))
+        return validator.collisions({
+            jsonfile: {"platform_name": name, "platform_is_domain": is_domain, "vm_names": vm_names}
+            for jsonfile, (name, is_domain, vm_names) in results.items()
+        })
+
+    def test_none(self):
+        self.assertEqual(self.collisions({
+            "a.json": ("a", False, ["a-srv1"]),
+            "ab.json": ("a-b", False, ["a-b-srv1"]),
+        }), [])
+
+    def test_defined_twice(self):
+        self.assertEqual(self.collisions({
+            "a.json": ("a", False, ["a-srv1"]),
+            "copy.json": ("a", False, ["a-srv1"]),
+        }), [{"vm_name": "a-srv1", "files": ["a.json", "copy.json"]}])
+
+    def test_claimed_by_longer_prefix(self):
+        self.assertEqual(self.collisions({
+            "a.json": ("a", False, ["a-b-srv1"]),
+            "ab.json": ("a-b", False, ["a-b-srv2"]),
+        }), [{"vm_name": "a-b-srv1", "files": ["a.json", "ab.json"]}])
+
+    def test_claimed_by_longer_suffix(self):
+        self.assertEqual(self.collisions({
+            "domain.json": ("example.com", True, ["srv1.sub.example.com"]),
+            "sub.json": ("sub.example.com", True, []),
+        }), [{"vm_name": "srv1.sub.example.com", "files": ["domain.json", "sub.json"]}])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,34 @@
+import unittest
+
+from opm.templateinfo import TemplateInfo, TemplateUserInput
+
+class UserInputsTest(unittest.TestCase):
+
+    def template(self):
+        return TemplateInfo(0, "tpl", [
+            TemplateUserInput("PASSWORD", True, "password", "Root password", [], None),
+            TemplateUserInput("SIZE", False, "list", "Size", ["small", "large"], None),
+            TemplateUserInput("ZONE", False, "text", "Zone", [], "north"),
+        ])
+
+    def test_optional_list_left_unset(self):
+        template = self.template()
+        self.assertEqual(template.check_user_inputs({"PASSWORD": "secret"}), [])
+        values = template.user_input_values({"PASSWORD": "secret"})
+        self.assertEqual([(user_input.name, value) for user_input, value in values], [("PASSWORD", "secret"), ("ZONE", "north")])
+        by_name = {user_input.name: value for user_input, value in values}
+        self.assertEqual(
+            [user_input.cli_argument(by_name.get(user_input.name)) for user_input in template.user_inputs],
+            ["PASSWORD=secret", "SIZE=", "ZONE=north"])
+
+    def test_invalid_list_value(self):
+        template = self.template()
+        self.assertEqual(len(template.check_user_inputs({"PASSWORD": "secret", "SIZE": "huge"})), 1)
+        with self.assertRaises(Exception):
+            template.user_inputs[1].cli_argument("huge")
+
+    def test_missing_mandatory(self):
+        self.assertEqual(len(self.template().check_user_inputs({})), 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import unittest
+
+from opm.topology import TopologyEdit
+from opm.vmdisk import VmDisk
+
+def disk(image, size_mb=None, dev_prefix=None, disk_id=None):
+    return VmDisk(image, size_mb, dev_prefix, disk_id)
+
+class ForNetworksTest(unittest.TestCase):
+
+    def test_unchanged(self):
+        edit = TopologyEdit.for_networks(("a", "b"), (0, 1), ["a", "b"])
+        self.assertEqual(len(edit), 0)
+
+    def test_appended(self):
+        edit = TopologyEdit.for_networks(("a",), (0,), ["a", "b"])
+        self.assertEqual((edit.detach, edit.attach), ([], ["b"]))
+
+    def test_removed_in_the_middle(self):
+        edit = TopologyEdit.for_networks(("a", "b", "c"), (0, 1, 3), ["a", "c"])
+        self.assertEqual((edit.detach, edit.attach), ([1], []))
+
+    def test_reordered(self):
+        # attached NIC always come last, b must be detached to come after a
+        edit = TopologyEdit.for_networks(("b", "a"), (0, 1), ["a", "b"])
+        self.assertEqual((edit.detach, edit.attach), ([0], ["b"]))
+
+class ForDisksTest(unittest.TestCase):
+
+    def test_prefix_left_out(self):
+        edit = TopologyEdit.for_disks((disk("root", 100, "vd", 0), disk("data", 200, "vd", 1)), [disk("root", 100), disk("data")])
+        self.assertEqual(len(edit), 0)
+
+    def test_prefix_differs(self):
+        with self.assertRaises(Exception):
+            TopologyEdit.for_disks((disk("root", 100, "vd", 0),), [disk("root", 100, "sd")])
+
+    def test_grown(self):
+        edit = TopologyEdit.for_disks((disk("root", 100, "vd", 0), disk("data", 200, "vd", 1)), [disk("root", 100), disk("data", 300)])
+        self.assertEqual((edit.detach, edit.attach, edit.resize), ([], [], [(1, 300)]))
+
+    def test_attached_and_detached(self):
+        edit = TopologyEdit.for_disks((disk("root", 100, "vd", 0), disk("old", 200, "vd", 1)), [disk("root"), disk("new", 50)])
+        self.assertEqual(edit.detach, [1])
+        self.assertEqual([attached.image for attached in edit.attach], ["new"])
+
+    def test_root_disk_differs(self):
+        with self.assertRaises(Exception):
+            TopologyEdit.for_disks((disk("root", 100, "vd", 0),), [disk("other", 100)])
+
+    def test_shrunk(self):
+        with self.assertRaises(Exception):
+            TopologyEdit.for_disks((disk("root", 100, "vd", 0), disk("data", 200, "vd", 1)), [disk("root"), disk("data", 100)])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+import asyncio
+import unittest
+
+from opm.capacity import HostCapacity
+from opm.tracker import StateTracker
+from opm.vminfo import VmInfo
+
+class FakeOne:
+
+    # one host with room for two VM, releases of some VM refused
+    def __init__(self, vms, refused):
+        self.vms = {vm.name: vm for vm in vms}
+        self.refused = refused
+        self.released = []
+
+    def vm_list(self, name_filter=None, owner="all", id_range=None):
+        return {name: vm for name, vm in self.vms.items() if name_filter is None or name_filter(name)}
+
+    def host_capacity(self):
+        return [HostCapacity(0, "host0", "default", 2, 200, 1024, 200, 1024)]
+
+    def vm_release(self, vm_info):
+        if vm_info.name in self.refused:
+            raise Exception("VM {0} is locked".format(vm_info.id))
+        self.released.append(vm_info.name)
+        # deployed right away
+        vm_info.state = 3
+        vm_info.lcm_state = 3
+
+class ReleaseWavesTest(unittest.TestCase):
+
+    def test_wave_failing_to_release(self):
+        vms = [VmInfo("vm-a", 1, 1, 512, vm_id=0, state=2), VmInfo("vm-b", 1, 1, 512, vm_id=1, state=2)]
+        one = FakeOne(vms, refused=["vm-a"])
+        done = []
+        results = StateTracker(one, interval=0).release_waves(vms, 10, lambda vm, error, seconds: done.append((vm.name, error is None)))
+        self.assertIsNotNone(results["vm-a"])
+        self.assertIsNone(results["vm-b"])
+        self.assertEqual(one.released, ["vm-b"])
+        self.assertEqual(sorted(done), [("vm-a", False), ("vm-b", True)])
+
+    def test_nothing_to_wait_for(self):
+        tracker = StateTracker(FakeOne([], []))
+        self.assertEqual(asyncio.run(tracker.wait_all([], tracker.deployed, "deployed", 10)), {})
+
+if __name__ == '__main__':
+    unittest.main()
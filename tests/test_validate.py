@@ -0,0 +1,26 @@
+import unittest
+
+from opm.validate import check_definition
+
+class CheckDefinitionTest(unittest.TestCase):
+
+    def errors(self, content):
+        return [error["type"] for error in check_definition("test.json", content.encode(), None)["errors"]]
+
+    def test_invalid_json(self):
+        self.assertEqual(self.errors('{"platform_name": '), ["invalid-json"])
+
+    def test_class_not_an_object(self):
+        self.assertEqual(self.errors('{"platform_name": "p", "classes": {"k": "notadict"}}'), ["invalid-definition"])
+
+    def test_host_not_an_object(self):
+        self.assertEqual(self.errors('{"platform_name": "p", "hosts": {"h": 3}}'), ["invalid-definition"])
+
+    def test_hosts_not_an_object(self):
+        self.assertEqual(self.errors('{"platform_name": "p", "hosts": [1]}'), ["invalid-definition"])
+
+    def test_unknown_class(self):
+        self.assertEqual(self.errors('{"platform_name": "p", "hosts": {"h": {"class": "k"}}}'), ["unknown-class"])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+#
+# Minimal in-memory stand-in for the OpenNebula XML-RPC API, covering the
+# calls made by opm. Meant for local testing only :
+#
+#   ./tools/one_standin.py --port 2633 &
+#   export ONE_XMLRPC=http://localhost:2633/RPC2
+#   echo "oneadmin:password" > /tmp/one_auth; export ONE_AUTH=/tmp/one_auth
+#   ./opm.py --backend xmlrpc status docs/example.json
+
+import argparse
+import logging
+import random
+import re
+import socketserver
+import threading
+from xml.sax.saxutils import escape
+from xmlrpc.server import SimpleXMLRPCRequestHandler, SimpleXMLRPCServer
+
+PERMISSION_NAMES = [
+    "OWNER_U", "OWNER_M", "OWNER_A",
+    "GROUP_U", "GROUP_M", "GROUP_A",
+    "OTHER_U", "OTHER_M", "OTHER_A",
+]
+
+def parse_template(text):
+    # KEY="value" and KEY=[SUB="value", ...] ; vector attributes may repeat
+    attrs = []
+    pattern = r'(\w+)\s*=\s*(?:\[(.*?)\]|"((?:[^"\\]|\\.)*)"|(\S+))'
+    for m in re.finditer(pattern, text, re.S):
+        key, vector, quoted, bare = m.groups()
+        if vector is not None:
+            attrs.append((key.upper(), dict(
+                (k.upper(), v.replace('\\"', '"'))
+                for k, v in re.findall(r'(\w+)\s*=\s*"((?:[^"\\]|\\.)*)"', vector))))
+        else:
+            attrs.append((key.upper(), quoted.replace('\\"', '"') if quoted is not None else bare))
+    return attrs
+
+def element(name, value):
+    return "<{0}>{1}</{0}>".format(name, escape(str(value)))
+
+class Cloud:
+
+    # OpenNebula error code of locked resources
+    LOCKED=0x8000
+
+    def __init__(self, user="oneadmin", locked_rate=0, hosts=0, host_cpu=800, host_memory_mb=16384):
+        self.lock = threading.Lock()
+        self.user = user
+        self.locked_rate = locked_rate
+        # without hosts, released VM run right away
+        self.hosts = {
+            host_id: {"name": "host{0}".format(host_id), "cpu": host_cpu, "memory": host_memory_mb, "vms": set()}
+            for host_id in range(hosts)
+        }
+        self.groups = {0: "oneadmin", 1: "users"}
+        self.templates = {
+            0: {"NAME": "ttylinux", "USER_INPUTS": {}},
+            1: {"NAME": "debian", "USER_INPUTS": {
+                "ROOT_PASSWORD": "M|password|Root password| |",
+                "FLAVOR": "O|list|Flavor|small,large|small",
+            }},
+        }
+        self.vms = {}
+        self.next_id = 0
+
+    def ok(self, value):
+        return [True, value, 0]
+
+    def error(self, message, code=-1):
+        return [False, message, code]
+
+    def vm_xml(self, vm_id, vm):
+        nics = "".join(
+            "<NIC>{0}{1}{2}</NIC>".format(
+                element("NETWORK", nic["NETWORK"]),
+                element("NETWORK_UNAME", nic["NETWORK_UNAME"]) if "NETWORK_UNAME" in nic else "",
+                element("NIC_ID", nic_id))
+            for nic_id, nic in sorted(vm["nics"].items()))
+        disks = "".join(
+            "<DISK>{0}{1}</DISK>".format(
+                element("DISK_ID", disk_id),
+                "".join(element(k, v) for k, v in sorted(disk.items())))
+            for disk_id, disk in sorted(vm["disks"].items()))
+        os_attrs = "".join(element(k, v) for k, v in sorted(vm["os"].items()))
+        return "<VM>{0}{1}{2}{3}{4}<PERMISSIONS>{5}</PERMISSIONS>{6}{7}<TEMPLATE>{8}{9}{10}<OS>{11}</OS>{12}{13}</TEMPLATE></VM>".format(
+            element("ID", vm_id),
+            element("UID", 0),
+            element("GID", vm["gid"]),
+            element("UNAME", self.user),
+            element("GNAME", self.groups[vm["gid"]]),
+            "".join(element(n, b) for n, b in zip(PERMISSION_NAMES, vm["permissions"])),
+            element("NAME", vm["name"]),
+            element("STATE", vm["state"]) + element("LCM_STATE", vm["lcm_state"]),
+            element("CPU", vm["cpu"]),
+            element("VCPU", vm["vcpu"]),
+            element("MEMORY", vm["memory"]),
+            os_attrs,
+            nics,
+            disks)
+
+    def demand(self, vm):
+        return int(round(float(vm["cpu"]) * 100)), int(vm["memory"])
+
+    def used(self, host):
+        cpu = sum(self.demand(self.vms[vm_id])[0] for vm_id in host["vms"])
+        memory = sum(self.demand(self.vms[vm_id])[1] for vm_id in host["vms"])
+        return cpu, memory
+
+    def schedule(self):
+        # pending VM deployed on the first host with room, in ID order, like
+        # a scheduler without overcommitment
+        for vm_id, vm in sorted(self.vms.items()):
+            if vm["state"] != 1:
+                continue
+            cpu, memory = self.demand(vm)
+            for host_id, host in sorted(self.hosts.items()):
+                used_cpu, used_memory = self.used(host)
+                if used_cpu + cpu <= host["cpu"] and used_memory + memory <= host["memory"]:
+                    host["vms"].add(vm_id)
+                    vm["state"] = 3
+                    vm["lcm_state"] = 3
+                    break
+
+    def hostpool_info(self, session):
+        with self.lock:
+            return self.ok("<HOST_POOL>{0}</HOST_POOL>".format("".join(
+                "<HOST>{0}{1}{2}{3}<HOST_SHARE>{4}{5}{6}{7}</HOST_SHARE></HOST>".format(
+                    element("ID", host_id),
+                    element("NAME", host["name"]),
+                    element("STATE", 2),
+                    element("CLUSTER", "default"),
+                    element("MAX_MEM", host["memory"] * 1024),
+                    element("MAX_CPU", host["cpu"]),
+                    element("MEM_USAGE", self.used(host)[1] * 1024),
+                    element("CPU_USAGE", self.used(host)[0]))
+                for host_id, host in sorted(self.hosts.items()))))
+
+    def user_info(self, session, user_id):
+        return self.ok("<USER>{0}{1}{2}</USER>".format(element("ID", 0), element("GID", 0), element("NAME", self.user)))
+
+    def grouppool_info(self, session):
+        return self.ok("<GROUP_POOL>{0}</GROUP_POOL>".format("".join(
+            "<GROUP>{0}{1}</GROUP>".format(element("ID", k), element("NAME", v))
+            for k, v in sorted(self.groups.items()))))
+
+    def templatepool_info(self, session, flag, start, end):
+        return self.ok("<VMTEMPLATE_POOL>{0}</VMTEMPLATE_POOL>".format("".join(
+            "<VMTEMPLATE>{0}{1}</VMTEMPLATE>".format(element("ID", k), element("NAME", v["NAME"]))
+            for k, v in sorted(self.templates.items()))))
+
+    def template_info(self, session, template_id, extended, *extra):
+        if template_id not in self.templates:
+            return self.error("Template {0} not found".format(template_id))
+        template = self.templates[template_id]
+        user_inputs = "".join(element(k, v) for k, v in sorted(template["USER_INPUTS"].items()))
+        return self.ok("<VMTEMPLATE>{0}{1}<TEMPLATE>{2}</TEMPLATE></VMTEMPLATE>".format(
+            element("ID", template_id),
+            element("NAME", template["NAME"]),
+            "<USER_INPUTS>{0}</USER_INPUTS>".format(user_inputs) if user_inputs else ""))
+
+    def vmpool_info(self, session, flag, start, end, state, *extra):
+        with self.lock:
+            return self.ok("<VM_POOL>{0}</VM_POOL>".format("".join(
+                self.vm_xml(k, v) for k, v in sorted(self.vms.items())
+                if state < 0 or v["state"] == state)))
+
+    def vm_allocate(self, session, template, hold):
+        vm = {
+            "name": None, "cpu": 1, "vcpu": 1, "memory": 128, "os": {},
+            "nics": {}, "disks": {}, "gid": 0,
+            "permissions": [1, 1, 0, 0, 0, 0, 0, 0, 0],
+            "state": 2 if hold else 1, "lcm_state": 0,
+        }
+        for key, value in parse_template(template):
+            if key == "NAME":
+                vm["name"] = value
+            elif key in ("CPU", "VCPU", "MEMORY"):
+                vm[key.lower()] = value
+            elif key == "OS":
+                vm["os"] = value
+            elif key == "NIC":
+                vm["nics"][len(vm["nics"])] = value
+            elif key == "DISK":
+                vm["disks"][len(vm["disks"])] = value
+        with self.lock:
+            vm_id = self.next_id
+            self.next_id += 1
+            if vm["name"] is None:
+                vm["name"] = "one-{0}".format(vm_id)
+            self.vms[vm_id] = vm
+        return self.ok(vm_id)
+
+    def template_instantiate(self, session, template_id, name, hold, extra, persistent):
+        if template_id not in self.templates:
+            return self.error("Template {0} not found".format(template_id))
+        given = set(key for key, value in parse_template(extra))
+        for key, value in self.templates[template_id]["USER_INPUTS"].items():
+            if value.startswith("M|") and key not in given:
+                return self.error("Missing user input {0}".format(key))
+        return self.vm_allocate(session, 'NAME="{0}"\n{1}'.format(name, extra), hold)
+
+    def vm_chown(self, session, vm_id, uid, gid):
+        if vm_id not in self.vms:
+            return self.error("VM {0} not found".format(vm_id))
+        if gid >= 0:
+            self.vms[vm_id]["gid"] = gid
+        return self.ok(vm_id)
+
+    def vm_chmod(self, session, vm_id, *bits):
+        if vm_id not in self.vms:
+            return self.error("VM {0} not found".format(vm_id))
+        self.vms[vm_id]["permissions"] = [
+            old if new < 0 else new
+            for old, new in zip(self.vms[vm_id]["permissions"], bits)
+        ]
+        return self.ok(vm_id)
+
+    def vm_action(self, session, action, vm_id):
+        with self.lock:
+            if vm_id not in self.vms:
+                return self.error("VM {0} not found".format(vm_id))
+            if action in ("terminate", "terminate-hard"):
+                del self.vms[vm_id]
+                for host in self.hosts.values():
+                    host["vms"].discard(vm_id)
+                self.schedule()
+            elif action == "release" and len(self.hosts) > 0:
+                self.vms[vm_id]["state"] = 1
+                self.schedule()
+            elif action == "release":
+                self.vms[vm_id]["state"] = 3
+                self.vms[vm_id]["lcm_state"] = 3
+            else:
+                return self.error("Unsupported action {0}".format(action))
+        return self.ok(vm_id)
+
+    def vm_info(self, session, vm_id, decrypt=False):
+        with self.lock:
+            if vm_id not in self.vms:
+                return self.error("VM {0} not found".format(vm_id))
+            return self.ok(self.vm_xml(vm_id, self.vms[vm_id]))
+
+    def hotplug(self, vm_id, kind, template=None, item_id=None):
+        # attached NIC and disks get the next free ID, like oned
+        with self.lock:
+            if vm_id not in self.vms:
+                return self.error("VM {0} not found".format(vm_id))
+            items = self.vms[vm_id][kind]
+            if template is not None:
+                attrs = [value for key, value in parse_template(template) if key in ("NIC", "DISK")]
+                if len(attrs) != 1:
+                    return self.error("Expected a single NIC or DISK")
+                new_id = max(items) + 1 if len(items) > 0 else 0
+                items[new_id] = attrs[0]
+                return self.ok(vm_id)
+            if item_id not in items:
+                return self.error("{0} {1} not found in VM {2}".format(kind, item_id, vm_id))
+            del items[item_id]
+            return self.ok(vm_id)
+
+    def vm_attachnic(self, session, vm_id, template):
+        return self.hotplug(vm_id, "nics", template=template)
+
+    def vm_detachnic(self, session, vm_id, nic_id):
+        return self.hotplug(vm_id, "nics", item_id=nic_id)
+
+    def vm_attach(self, session, vm_id, template):
+        return self.hotplug(vm_id, "disks", template=template)
+
+    def vm_detach(self, session, vm_id, disk_id):
+        return self.hotplug(vm_id, "disks", item_id=disk_id)
+
+    def vm_diskresize(self, session, vm_id, disk_id, size):
+        with self.lock:
+            if vm_id not in self.vms or disk_id not in self.vms[vm_id]["disks"]:
+                return self.error("Disk {0} not found in VM {1}".format(disk_id, vm_id))
+            disk = self.vms[vm_id]["disks"][disk_id]
+            if int(size) <= int(disk.get("SIZE", 0)):
+                return self.error("New size must be larger than the current one")
+            disk["SIZE"] = str(size)
+        return self.ok(vm_id)
+
+    def vm_resize(self, session, vm_id, template, enforce):
+        if vm_id not in self.vms:
+            return self.error("VM {0} not found".format(vm_id))
+        for key, value in parse_template(template):
+            if key in ("CPU", "VCPU", "MEMORY"):
+                self.vms[vm_id][key.lower()] = value
+        return self.ok(vm_id)
+
+    def lockable(self, method, function):
+        # VM changes randomly refused as if another operation held the VM
+        def call(session, *args):
+            if random.random() < self.locked_rate:
+                return self.error("[{0}] The resource is locked".format(method), self.LOCKED)
+            return function(session, *args)
+        return call
+
+    def register(self, server):
+        server.register_function(self.user_info, "one.user.info")
+        server.register_function(self.grouppool_info, "one.grouppool.info")
+        server.register_function(self.templatepool_info, "one.templatepool.info")
+        server.register_function(self.template_info, "one.template.info")
+        server.register_function(self.vmpool_info, "one.vmpool.info")
+        server.register_function(self.vm_info, "one.vm.info")
+        server.register_function(self.hostpool_info, "one.hostpool.info")
+        for function, method in [
+            (self.vm_allocate, "one.vm.allocate"),
+            (self.template_instantiate, "one.template.instantiate"),
+            (self.vm_chown, "one.vm.chown"),
+            (self.vm_chmod, "one.vm.chmod"),
+            (self.vm_action, "one.vm.action"),
+            (self.vm_resize, "one.vm.resize"),
+            (self.vm_attachnic, "one.vm.attachnic"),
+            (self.vm_detachnic, "one.vm.detachnic"),
+            (self.vm_attach, "one.vm.attach"),
+            (self.vm_detach, "one.vm.detach"),
+            (self.vm_diskresize, "one.vm.diskresize"),
+        ]:
+            server.register_function(self.lockable(method, function), method)
+        server.register_multicall_functions()
+
+class RequestHandler(SimpleXMLRPCRequestHandler):
+    # keep-alive, like oned
+    protocol_version = "HTTP/1.1"
+    rpc_paths = ("/RPC2",)
+
+class Server(socketserver.ThreadingMixIn, SimpleXMLRPCServer):
+    daemon_threads = True
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenNebula XML-RPC stand-in")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=2633)
+    parser.add_argument("--locked-rate", type=float, default=0,
+        help="Share of VM changes refused as locked, to exercise retries.")
+    parser.add_argument("--hosts", type=int, default=0,
+        help="Number of hosts released VM are deployed to, VM staying pending"
+        " when none has room ; 0 runs every VM right away.")
+    parser.add_argument("--host-cpu", type=int, default=800,
+        help="CPU of each host, in percent of a core.")
+    parser.add_argument("--host-memory-mb", type=int, default=16384,
+        help="Memory of each host.")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    server = Server((args.host, args.port), requestHandler=RequestHandler, allow_none=True, logRequests=False)
+    Cloud(locked_rate=args.locked_rate, hosts=args.hosts, host_cpu=args.host_cpu, host_memory_mb=args.host_memory_mb).register(server)
+    logging.info("Listening on http://{0}:{1}/RPC2".format(args.host, args.port))
+    server.serve_forever()
+
+if __name__ == '__main__':
+    main()